@@ -1,16 +1,109 @@
 import streamlit as st
 import os
-import shutil
-from audio_fetcher import download_audio
-from lyrics_engine import transcribe_with_lyrics, isolate_vocals
-from renderer import create_lyrics_video
-from font_manager import GOOGLE_FONTS, get_font_path
-from PIL import Image, ImageDraw, ImageFont, ImageStat
+import time
+import uuid
+from job_queue import JobQueue, JOBS_DIR, DONE, FAILED, QUEUED
+from font_manager import GOOGLE_FONTS, get_font_path, load_font
+from PIL import Image, ImageDraw, ImageStat
 import json
 
 # Setup
 st.set_page_config(page_title="GenLyrics Studio", page_icon="�", layout="wide")
 
+# Whisper
+WHISPER_MODEL = "medium"
+
+@st.cache_resource
+def get_job_queue():
+    # One queue for every session. Imports and renders run in worker
+    # processes, at most GENLYRICS_IMPORT_WORKERS / GENLYRICS_RENDER_WORKERS
+    # at a time; the import workers keep Whisper and Demucs loaded.
+    limits = {
+        "import": int(os.environ.get("GENLYRICS_IMPORT_WORKERS", 1)),
+        "render": int(os.environ.get("GENLYRICS_RENDER_WORKERS", 1)),
+    }
+    # GENLYRICS_WARMUP=1 loads the model when the workers start instead of on the first import
+    warm_up = WHISPER_MODEL if os.environ.get("GENLYRICS_WARMUP") == "1" else None
+    return JobQueue(limits=limits, warm_up=warm_up)
+
+jobs = get_job_queue()
+
+# Preview
+PREVIEW_RESOLUTION = (960, 540)
+
+def h2rgba(h, a=255):
+    h = h.lstrip('#')
+    return tuple(int(h[i:i+2], 16) for i in (0, 2, 4)) + (a,)
+
+def session_dir():
+    """
+    This session's own directory for uploads and render chunks.
+    """
+    path = os.path.join(JOBS_DIR, "sessions", st.session_state.session_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def prepare_bg_path(bg_file):
+    """
+    Path of the background to render with (uploads are saved to the session directory).
+    """
+    if bg_file:
+        bg_path = os.path.join(session_dir(), "bg_" + os.path.basename(bg_file.name))
+        if not os.path.exists(bg_path) or os.path.getsize(bg_path) != bg_file.size:
+            bg_file.seek(0)
+            with open(bg_path, "wb") as f:
+                f.write(bg_file.getbuffer())
+        return bg_path
+    if os.path.exists("default_bg_16_9.png"):
+        return "default_bg_16_9.png"
+    return "sunset_mountains_bg.png"
+
+@st.cache_resource(max_entries=2)
+def get_preview_renderer(segments_json, bg_path, font_path, color_active, color_inactive, karaoke_wipe):
+    # Layouts and sprites stay cached while scrubbing through the timeline
+    # Imported here so reruns without a preview never load the renderer
+    from renderer import FrameRenderer
+    return FrameRenderer(json.loads(segments_json), bg_path, font_path,
+                         h2rgba(color_active), h2rgba(color_inactive, 180),
+                         resolution=PREVIEW_RESOLUTION, karaoke_wipe=karaoke_wipe)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def background_brightness(bg_path, mtime):
+    """
+    Mean brightness (0-255) of a background, measured on a small thumbnail.
+    mtime is only part of the cache key.
+    """
+    with Image.open(bg_path) as img:
+        # JPEGs are decoded straight at reduced size
+        img.draft('L', (256, 256))
+        img.thumbnail((256, 256))
+        return ImageStat.Stat(img.convert('L')).mean[0]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def style_preview(font_path, color_active, color_inactive):
+    """
+    The typography preview; only redrawn when the font or colors change.
+    """
+    preview_h, preview_w = 150, 400
+    # Use actual bg color if possible or just dark
+    preview_img = Image.new('RGBA', (preview_w, preview_h), (30, 30, 30, 255))
+    draw = ImageDraw.Draw(preview_img)
+    p_font = load_font(font_path, 40)
+
+    # Draw Inactive
+    draw.text((20, 20), "Previous Line...", font=p_font, fill=color_inactive)
+    # Draw Active
+    draw.text((20, 70), "Current Sung Line!", font=p_font, fill=color_active)
+    return preview_img
+
+def show_timings(summary):
+    """
+    Timing breakdown of the last run, one row per stage.
+    """
+    rows = [{"Stage": name, "Seconds": round(seconds, 2)} for name, seconds in summary['spans'].items()]
+    if rows:
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+
 # Custom CSS for "CapCut" vibe
 st.markdown("""
 <style>
@@ -39,6 +132,8 @@ if 'segments' not in st.session_state:
     st.session_state.segments = []
 if 'audio_path' not in st.session_state:
     st.session_state.audio_path = None
+if 'vocals_path' not in st.session_state:
+    st.session_state.vocals_path = None
 if 'video_path' not in st.session_state:
     st.session_state.video_path = None
 if 'title' not in st.session_state:
@@ -47,6 +142,129 @@ if 'color_active' not in st.session_state:
     st.session_state.color_active = "#FFE600"
 if 'color_inactive' not in st.session_state:
     st.session_state.color_inactive = "#C8C8C8"
+if 'timings' not in st.session_state:
+    st.session_state.timings = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+# Ids of this session's current background jobs
+if 'import_job' not in st.session_state:
+    st.session_state.import_job = None
+if 'render_job' not in st.session_state:
+    st.session_state.render_job = None
+if 'align_job' not in st.session_state:
+    st.session_state.align_job = None
+# Edited lines waiting for the running alignment job to finish, by index
+if 'align_followup' not in st.session_state:
+    st.session_state.align_followup = {}
+
+def even_words(text, start, end):
+    """
+    Spreads a line's words evenly over its time span. Used until (or
+    instead of, when it fails) the alignment job returns real timings.
+    """
+    words = text.split()
+    per_word = (end - start) / max(len(words), 1)
+    return [{'word': w, 'start': start + i * per_word, 'end': start + (i + 1) * per_word}
+            for i, w in enumerate(words)]
+
+def apply_job_result(job):
+    """
+    Copies a finished job's output into the session.
+    """
+    result = job.result
+    if job.kind == "import":
+        st.session_state.audio_path = result['audio_path']
+        st.session_state.vocals_path = result['vocals_path']
+        st.session_state.title = result['title']
+        st.session_state.segments = result['segments']
+        st.session_state.timings = result['timings']
+        # Nothing to keep in an import's directory (downloads live in the cache)
+        jobs.discard(job.id)
+    elif job.kind == "align":
+        segments = st.session_state.segments
+        for line in result['lines']:
+            words = result['words'].get(line['index'])
+            i = line['index']
+            # Skip lines edited again (or deleted) while the job ran
+            if (words and i < len(segments) and segments[i]['text'].strip() == line['text']
+                    and (segments[i]['start'], segments[i]['end']) == (line['start'], line['end'])):
+                segments[i]['words'] = words
+        jobs.discard(job.id)
+    else:
+        st.session_state.video_path = result['video_path']
+        st.session_state.subtitle_paths = result.get('subtitles', {})
+        st.session_state.format_videos = result.get('videos', {})
+        st.session_state.render_timings = result['timings']
+        # The new video replaces the previous one
+        if st.session_state.get('video_job'):
+            jobs.discard(st.session_state.video_job)
+        st.session_state.video_job = job.id
+
+def submit_align(lines):
+    """
+    Re-times edited lines in the background. A queued alignment job takes
+    the new lines in; a running one is left to finish (cancelling it would
+    stop the worker holding the loaded model) and the lines follow it.
+    """
+    pending = dict(st.session_state.align_followup)
+    pending.update({line['index']: line for line in lines})
+    previous = jobs.get(st.session_state.align_job) if st.session_state.align_job else None
+    if previous is not None and previous.state == QUEUED:
+        jobs.cancel(previous.id)
+        jobs.discard(previous.id)
+        for line in previous.params['lines']:
+            pending.setdefault(line['index'], line)
+    elif previous is not None and previous.active:
+        st.session_state.align_followup = pending
+        return
+    st.session_state.align_followup = {}
+    if pending:
+        st.session_state.align_job = jobs.submit("align", {
+            'vocals_path': st.session_state.vocals_path, 'lines': list(pending.values()),
+            'model_size': WHISPER_MODEL})
+
+@st.fragment(run_every=1)
+def job_status(slot):
+    """
+    Polls the session's job in st.session_state[slot]: progress, cancel
+    button, and the result once it is done.
+    """
+    job = jobs.get(st.session_state[slot]) if st.session_state[slot] else None
+    if job is None:
+        return
+
+    if job.state == QUEUED:
+        st.caption(f"Queued ({jobs.position(job.id)} ahead)")
+    elif job.active:
+        label = (job.stage or "starting").replace("_", " ").capitalize()
+        text = f"{label}... {time.time() - job.started:.0f}s"
+        if job.message:
+            text += f" ({job.message})"
+        st.progress(job.progress or 0.0, text=text)
+
+    if job.active:
+        # Alignments are short and share the worker holding the models: no cancel
+        if job.kind != "align" and st.button("✖ Cancel", key=f"cancel_{slot}"):
+            jobs.cancel(job.id)
+            jobs.discard(job.id)
+            st.session_state[slot] = None
+            st.rerun()
+        return
+
+    st.session_state[slot] = None
+    if job.state == DONE:
+        apply_job_result(job)
+    else:
+        if job.state == FAILED:
+            st.session_state.job_error = f"{job.kind.capitalize()} failed: {job.error}"
+        jobs.discard(job.id)
+    if slot == "align_job" and st.session_state.align_followup:
+        submit_align([])
+    # Refresh the whole page with the new result
+    st.rerun()
+
+if st.session_state.get('job_error'):
+    st.error(st.session_state.pop('job_error'))
 
 
 # --- LAYOUT ---
@@ -62,50 +280,29 @@ with st.sidebar:
         if input_method == "YouTube":
             url = st.text_input("YouTube URL", placeholder="Paste link here...")
             use_cookies = st.checkbox("Use Cookies (Fix 'Sign in')", value=True)
-            if st.button("🚀 Import & Process"):
+            if st.button("🚀 Import & Process", disabled=bool(st.session_state.import_job)):
                 if not url:
                     st.error("Enter URL")
                 else:
-                    with st.status("Importing Media...", expanded=True) as status:
-                        try:
-                            st.write("Downloading...")
-                            audio_path, title = download_audio(url, use_cookies=use_cookies)
-                            st.session_state.audio_path = audio_path
-                            st.session_state.title = title
-                            
-                            st.write("Isolating Vocals...")
-                            vocals_path = isolate_vocals(audio_path)
-                            
-                            st.write("Transcribing...")
-                            segments = transcribe_with_lyrics(vocals_path, model_size="medium")
-                            st.session_state.segments = segments
-                            status.update(label="Ready to Edit!", state="complete", expanded=False)
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error: {e}")
-                            status.update(label="Failed", state="error")
-                            
+                    st.session_state.import_job = jobs.submit("import", {
+                        'source': url, 'use_cookies': use_cookies, 'model_size': WHISPER_MODEL})
+                    st.rerun()
+
         else:
             uploaded = st.file_uploader("Upload Audio", type=["mp3", "wav"])
-            if uploaded and st.button("🚀 Process File"):
-                with st.status("Processing...", expanded=True) as status:
-                    temp_dir = "temp"
-                    os.makedirs(temp_dir, exist_ok=True)
-                    file_path = os.path.join(temp_dir, uploaded.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded.getbuffer())
-                    
-                    st.session_state.audio_path = file_path
-                    st.session_state.title = uploaded.name
-                    
-                    try:
-                        vocals_path = isolate_vocals(file_path)
-                        segments = transcribe_with_lyrics(vocals_path, model_size="medium")
-                        st.session_state.segments = segments
-                        status.update(label="Ready!", state="complete", expanded=False)
-                        st.rerun()
-                    except Exception as e:
-                        st.error(str(e))
+            if uploaded and st.button("🚀 Process File", disabled=bool(st.session_state.import_job)):
+                file_path = os.path.join(session_dir(), os.path.basename(uploaded.name))
+                with open(file_path, "wb") as f:
+                    f.write(uploaded.getbuffer())
+                st.session_state.import_job = jobs.submit("import", {
+                    'source': file_path, 'title': uploaded.name, 'model_size': WHISPER_MODEL})
+                st.rerun()
+
+        job_status("import_job")
+
+        if st.session_state.timings:
+            with st.expander("⏱️ Last import timing"):
+                show_timings(st.session_state.timings)
 
     # --- 2. STYLE ---
     with st.expander("🎨 2. Design & Style", expanded=True):
@@ -129,9 +326,8 @@ with st.sidebar:
         # Logic for auto-color (hidden unless bg exists)
         if bg_file:
             # Auto detect
-            img = Image.open(bg_file)
-            stat = ImageStat.Stat(img.convert('L'))
-            avg_bright = stat.mean[0]
+            bg_path = prepare_bg_path(bg_file)
+            avg_bright = background_brightness(bg_path, os.path.getmtime(bg_path))
             if st.button("🪄 Auto-Match Colors"):
                 if avg_bright < 128:
                     st.session_state.color_active = "#FFE600"
@@ -148,41 +344,64 @@ with st.sidebar:
             color_inactive = st.color_picker("Inactive", st.session_state.color_inactive)
             st.session_state.color_inactive = color_inactive
 
+        karaoke_wipe = st.checkbox("Karaoke wipe", help="Fill each word from left to right while it is sung")
+        fast_render = st.checkbox("Fast render (subtitles)",
+                                  help="Burn the lyrics in as ASS karaoke with ffmpeg instead of drawing every frame")
+
     # --- 3. EXPORT ---
     with st.expander("📤 3. Export", expanded=True):
-        if st.button("🔥 Render Video", type="primary"):
+        # Extra formats come from the frame loop, so they can't use the subtitle backend
+        extra_formats = st.multiselect("Also render", ["shorts", "square"], disabled=fast_render,
+                                       help="9:16 and 1:1 versions, drawn in the same pass as the 16:9 video "
+                                            "(not with fast render)")
+        if fast_render:
+            extra_formats = []
+        rendering = bool(st.session_state.render_job)
+        render_clicked = st.button("🔥 Render Video", type="primary", disabled=rendering)
+        draft_clicked = st.button("⚡ Draft Video (480p)", disabled=rendering)
+        if render_clicked or draft_clicked:
             if not st.session_state.segments:
                 st.warning("No lyrics to render")
             else:
-                with st.status("Rendering...", expanded=True):
-                    out_name = "output_final.mp4"
-                    
-                    # Prepare BG
-                    bg_path = "sunset_mountains_bg.png"
-                    if bg_file:
-                        bg_path = os.path.join("temp", bg_file.name)
-                        bg_file.seek(0)
-                        with open(bg_path, "wb") as f:
-                            f.write(bg_file.getbuffer())
-                    elif os.path.exists("default_bg_16_9.png"):
-                         bg_path = "default_bg_16_9.png"
-                    
-                    # Colors
-                    def h2rgba(h, a=255):
-                        h = h.lstrip('#')
-                        return tuple(int(h[i:i+2], 16) for i in (0, 2, 4)) + (a,)
-                    
-                    create_lyrics_video(
-                        st.session_state.audio_path,
-                        st.session_state.segments,
-                        out_name,
-                        bg_image_path=bg_path,
-                        font_path=selected_font_path,
-                        color_active=h2rgba(color_active),
-                        color_inactive=h2rgba(color_inactive, 180)
-                    )
-                    st.session_state.video_path = out_name
-                    st.success("Done!")
+                kind = "draft" if draft_clicked else "final"
+                formats = ["landscape"] + extra_formats if extra_formats and not draft_clicked else None
+                options = {
+                    'bg_image_path': prepare_bg_path(bg_file),
+                    'font_path': selected_font_path,
+                    'color_active': h2rgba(color_active),
+                    'color_inactive': h2rgba(color_inactive, 180),
+                    'karaoke_wipe': karaoke_wipe,
+                    'sidecars': not draft_clicked,
+                }
+                if not formats:
+                    options.update({
+                        'draft': draft_clicked,
+                        'backend': "ass" if fast_render else "frames",
+                        # Re-renders after an edit only re-encode the changed chunks
+                        'incremental': True,
+                        'chunk_dir': os.path.join(session_dir(), f"{kind}.chunks"),
+                    })
+                st.session_state.render_job = jobs.submit("render", {
+                    'audio_path': st.session_state.audio_path,
+                    'segments': st.session_state.segments,
+                    'output_name': f"output_{kind}.mp4",
+                    'formats': formats,
+                    'options': options,
+                })
+                st.rerun()
+
+        job_status("render_job")
+        for name, path in (st.session_state.get('format_videos') or {}).items():
+            if name != "landscape" and os.path.exists(path):
+                with open(path, "rb") as f:
+                    st.download_button(f"⬇️ Video ({name})", f, file_name=os.path.basename(path), key=f"dl_{name}")
+        for fmt, path in (st.session_state.get('subtitle_paths') or {}).items():
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    st.download_button(f"⬇️ Lyrics .{fmt}", f, file_name=os.path.basename(path), key=f"dl_{fmt}")
+        if st.session_state.get('render_timings'):
+            with st.expander("⏱️ Last render timing"):
+                show_timings(st.session_state.render_timings)
 
 # --- MAIN AREA ---
 # Top: Preview / Player
@@ -197,7 +416,16 @@ with col_preview:
     if st.session_state.video_path and os.path.exists(st.session_state.video_path):
         st.video(st.session_state.video_path)
     
-    if bg_file:
+    if st.session_state.segments:
+        # Accurate frame from the real renderer at any point of the song
+        song_end = float(st.session_state.segments[-1]['end'])
+        preview_t = st.slider("Preview at (s)", 0.0, song_end + 3, float(st.session_state.segments[0]['start']), step=0.05)
+        preview_renderer = get_preview_renderer(
+            json.dumps(st.session_state.segments), prepare_bg_path(bg_file),
+            selected_font_path, color_active, color_inactive, karaoke_wipe)
+        frame = preview_renderer.frame_at(preview_t)
+        st.image(frame, channels="BGR", caption=f"Frame at {preview_t:.2f}s", use_container_width=True)
+    elif bg_file:
         st.image(bg_file, caption="Background Preview", use_container_width=True)
     elif os.path.exists("default_bg_16_9.png"):
         st.image("default_bg_16_9.png", caption="Default Background (16:9)", use_container_width=True)
@@ -209,17 +437,8 @@ with col_props:
     # Live Font Preview
     if selected_font_path:
         try:
-            preview_h, preview_w = 150, 400
-            # Use actual bg color if possible or just dark
-            preview_img = Image.new('RGBA', (preview_w, preview_h), (30, 30, 30, 255))
-            draw = ImageDraw.Draw(preview_img)
-            p_font = ImageFont.truetype(selected_font_path, 40)
-            
-            # Draw Inactive
-            draw.text((20, 20), "Previous Line...", font=p_font, fill=st.session_state.color_inactive)
-            # Draw Active
-            draw.text((20, 70), "Current Sung Line!", font=p_font, fill=st.session_state.color_active)
-            
+            preview_img = style_preview(selected_font_path, st.session_state.color_active,
+                                        st.session_state.color_inactive)
             st.image(preview_img, use_container_width=True)
         except:
             st.warning("Font loading...")
@@ -251,21 +470,30 @@ if st.session_state.segments:
     
     if st.button("Update Timeline"):
         # Sync back
+        lines = []
+        rejected = []
         for i, row in enumerate(edited):
             if i < len(st.session_state.segments):
                 seg = st.session_state.segments[i]
-                if seg['text'] != row['Lyrics']:
-                    seg['text'] = row['Lyrics']
-                    # Simple re-sync of words
-                    words = row['Lyrics'].split()
-                    dur = seg['end'] - seg['start']
-                    per_word = dur / max(len(words), 1)
-                    cursor = seg['start']
-                    new_words = []
-                    for w in words:
-                        new_words.append({'word': w, 'start': cursor, 'end': cursor + per_word})
-                        cursor += per_word
-                    seg['words'] = new_words
-        st.success("Timeline Synced")
+                text = (row['Lyrics'] or "").strip()
+                if seg['text'].strip() != text or seg['start'] != row['Start'] or seg['end'] != row['End']:
+                    # Cleared cells come back as None
+                    if row['Start'] is None or row['End'] is None or not 0 <= row['Start'] < row['End']:
+                        rejected.append(i + 1)
+                        continue
+                    seg['text'] = " " + text
+                    seg['start'], seg['end'] = row['Start'], row['End']
+                    seg['words'] = even_words(text, seg['start'], seg['end'])
+                    lines.append({'index': i, 'text': text, 'start': seg['start'], 'end': seg['end'],
+                                  'language': seg.get('language')})
+        if lines and st.session_state.vocals_path:
+            # Re-time just the edited lines against their slice of the vocals
+            submit_align(lines)
+        if rejected:
+            st.error(f"Rows {', '.join(map(str, rejected))} not updated: Start and End must be set, "
+                     "with Start before End")
+        else:
+            st.success("Timeline Synced")
+    job_status("align_job")
 else:
     st.info("Import a song to see the timeline editor.")
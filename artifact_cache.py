@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; threads are still serialized
+    fcntl = None
+
+CACHE_DIR = "./cache"
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3 # 20 GB
+
+# (path, size, mtime) -> sha256, so unchanged files are hashed once per process
+_HASHES = {}
+
+def file_hash(path):
+    """
+    SHA-256 of a file's content.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _HASHES:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        _HASHES[memo_key] = h.hexdigest()
+    return _HASHES[memo_key]
+
+class ArtifactCache:
+    """
+    Content-addressed store for pipeline stage outputs.
+    Each entry is keyed by the stage name plus the hash of its input and its
+    parameters, lives in its own directory, and is tracked in an on-disk
+    manifest. Least recently used entries are evicted when the cache grows
+    past max_bytes.
+    Several processes can share a cache (app workers, the CLI): every
+    manifest update holds a file lock and is applied to the manifest as it
+    is on disk at that moment.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock_path = os.path.join(root, "manifest.lock")
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    @staticmethod
+    def key(stage, **params):
+        """
+        Cache key for a stage run. params must be JSON-serializable.
+        """
+        payload = json.dumps({"stage": stage, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_file(self, key):
+        """
+        Path of the cached file for key, or None on a miss.
+        """
+        with self._updating():
+            entry = self._touch(key)
+            if entry is None:
+                return None
+            return os.path.join(self._entry_dir(key), entry["file"])
+
+    def put_file(self, key, src_path, stage="", meta=None, move=False):
+        """
+        Stores a file under key and returns its path inside the cache.
+        """
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        name = os.path.basename(src_path)
+        dst_path = os.path.join(entry_dir, name)
+        if move:
+            shutil.move(src_path, dst_path)
+        else:
+            shutil.copyfile(src_path, dst_path)
+
+        self._add_entry(key, stage, {"file": name, "meta": meta or {}})
+        return dst_path
+
+    def get_json(self, key):
+        """
+        Cached JSON value for key, or None on a miss.
+        """
+        with self._updating():
+            entry = self._touch(key)
+            if entry is None:
+                return None
+            path = os.path.join(self._entry_dir(key), entry["file"])
+        with open(path) as f:
+            return json.load(f)
+
+    def put_json(self, key, value, stage="", meta=None):
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        with open(os.path.join(entry_dir, "value.json"), "w") as f:
+            json.dump(value, f)
+
+        self._add_entry(key, stage, {"file": "value.json", "meta": meta or {}})
+
+    def meta(self, key):
+        """
+        Metadata stored alongside an entry (e.g. a song title).
+        """
+        with self._lock:
+            self._manifest = self._load_manifest()
+            entry = self._manifest.get(key)
+            return dict(entry["meta"]) if entry else {}
+
+    def total_bytes(self):
+        with self._lock:
+            self._manifest = self._load_manifest()
+            return sum(entry["size"] for entry in self._manifest.values())
+
+    # --- internals ---
+
+    @contextmanager
+    def _updating(self):
+        """
+        Holds the thread and file locks and reloads the manifest from disk,
+        so changes made inside are merged with other processes' entries.
+        Callers write their changes with _save_manifest before leaving.
+        """
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._manifest = self._load_manifest()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _touch(self, key):
+        entry = self._manifest.get(key)
+        if entry is None:
+            return None
+        # Entry deleted behind our back
+        if not os.path.exists(os.path.join(self._entry_dir(key), entry["file"])):
+            del self._manifest[key]
+            self._save_manifest()
+            return None
+        entry["last_access"] = time.time()
+        self._save_manifest()
+        return entry
+
+    def _add_entry(self, key, stage, entry):
+        entry_dir = self._entry_dir(key)
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entry.update({"stage": stage, "size": size, "last_access": time.time()})
+
+        with self._updating():
+            self._manifest[key] = entry
+            self._evict(keep=key)
+            self._save_manifest()
+
+    def _evict(self, keep=None):
+        total = sum(entry["size"] for entry in self._manifest.values())
+        by_age = sorted(self._manifest.items(), key=lambda item: item[1]["last_access"])
+        for key, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            del self._manifest[key]
+            total -= entry["size"]
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print("Cache manifest unreadable, starting empty.")
+            return {}
+
+    def _save_manifest(self):
+        # Write then rename so a crash never leaves a half-written manifest;
+        # the temp name is unique so concurrent writers can't share it
+        fd, tmp_path = tempfile.mkstemp(prefix="manifest.", suffix=".tmp", dir=self.root)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -1,19 +1,15 @@
-import yt_dlp
 import os
+from tracing import traced
 
-def download_audio(url, output_dir="./temp", use_cookies=False):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        
-    print(f"Downloading audio from {url}...")
-    
+# yt_dlp is imported inside the functions that use it: it is slow to load
+# and only needed once something is actually downloaded
+
+def _ydl_opts(output_dir, use_cookies=False):
     ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '192',
-        }],
+        # Keep the original compressed stream: it is decoded once in memory
+        # for separation and stream-copied into the final video.
+        # m4a (AAC) first since MP4 can carry it without re-encoding.
+        'format': 'bestaudio[ext=m4a]/bestaudio/best',
         'outtmpl': f'{output_dir}/%(id)s.%(ext)s',
         'quiet': False,
     }
@@ -23,11 +19,47 @@ def download_audio(url, output_dir="./temp", use_cookies=False):
         # Can be changed to 'firefox' or others if needed, but Chrome is a safe default.
         ydl_opts['cookiesfrombrowser'] = ('chrome',)
 
+    return ydl_opts
+
+def get_video_info(url, use_cookies=False):
+    """
+    Looks up video metadata (id, title, ...) without downloading anything.
+    """
+    import yt_dlp
+
+    ydl_opts = _ydl_opts("./temp", use_cookies)
+    ydl_opts['quiet'] = True
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+def list_playlist(url, use_cookies=False):
+    """
+    Returns the video URLs of a playlist, or [url] if it is a single video.
+    """
+    import yt_dlp
+
+    ydl_opts = _ydl_opts("./temp", use_cookies)
+    ydl_opts['quiet'] = True
+    ydl_opts['extract_flat'] = 'in_playlist'
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
     
+    if info.get('_type') != 'playlist':
+        return [url]
+    return [entry.get('webpage_url') or entry['url'] for entry in info['entries'] if entry]
+
+@traced("download_audio")
+def download_audio(url, output_dir="./temp", use_cookies=False):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        
+    print(f"Downloading audio from {url}...")
+    
+    ydl_opts = _ydl_opts(output_dir, use_cookies)
+    
+    import yt_dlp
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(url, download=True)
         filename = ydl.prepare_filename(info)
-        # expected filename after post-processing
-        final_filename = os.path.splitext(filename)[0] + ".wav"
-        
-        return final_filename, info.get('title', 'Unknown Song')
+
+        return filename, info.get('title', 'Unknown Song')
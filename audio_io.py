@@ -0,0 +1,350 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import subprocess
+import weakref
+from collections import OrderedDict
+import numpy as np
+from tracing import span, count
+
+# Working format: Demucs' native rate/layout. Whisper gets a 16 kHz mono copy.
+SAMPLE_RATE = 44100
+CHANNELS = 2
+WHISPER_SAMPLE_RATE = 16000
+
+# Decodes larger than this (~12 min of 44.1 kHz stereo float32) go to a
+# memory-mapped temp file instead of the heap
+MEMMAP_THRESHOLD = 256 * 1024 ** 2
+_READ_BLOCK = 1024 * 1024
+
+# Audio codecs an MP4 can carry as-is, so the final mux can copy them
+MP4_AUDIO_CODECS = {"aac", "mp3", "alac", "ac3", "eac3", "opus"}
+
+class AudioBuffer:
+    """
+    Decoded float32 audio, shaped (samples, channels).
+    samples may be an in-memory array or a np.memmap over a temp file,
+    which is deleted when the buffer goes away.
+    """
+
+    def __init__(self, samples, sample_rate, temp_path=None):
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self._whisper = None
+        if temp_path:
+            weakref.finalize(self, _remove, temp_path)
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    @property
+    def planar(self):
+        """
+        (channels, samples) view, the layout Demucs works on. No copy.
+        """
+        return self.samples.T
+
+    def whisper_audio(self):
+        """
+        16 kHz mono float32, the input Whisper expects. Computed once.
+        """
+        if self._whisper is None:
+            if isinstance(self.samples, np.memmap):
+                # Spilled (long) tracks are downmixed block by block straight
+                # into ffmpeg's resampler, never as one full-rate mono array
+                with span("audio_resample"):
+                    self._whisper = _resample_ffmpeg(self._mono_blocks(), self.sample_rate,
+                                                     WHISPER_SAMPLE_RATE)
+            else:
+                mono = self.samples.mean(axis=1, dtype=np.float32)
+                self._whisper = resample(mono, self.sample_rate, WHISPER_SAMPLE_RATE)
+        return self._whisper
+
+    def _mono_blocks(self, block=_READ_BLOCK):
+        for start in range(0, len(self.samples), block):
+            yield self.samples[start:start + block].mean(axis=1, dtype=np.float32)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def decode_audio(path, sample_rate=SAMPLE_RATE, channels=CHANNELS, memmap_threshold=MEMMAP_THRESHOLD):
+    """
+    Decodes any ffmpeg-readable file to float32 in one pass.
+    Output is streamed: it stays in memory up to memmap_threshold bytes and
+    is spilled to a memory-mapped temp file past that, so hour-long tracks
+    do not need their full decode on the heap.
+    """
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '0', '-i', path,
+           '-f', 'f32le', '-ac', str(channels), '-ar', str(sample_rate), '-']
+
+    with span("audio_decode"):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Drain stderr on the side so a chatty ffmpeg cannot block stdout
+        errors = []
+        stderr_reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+        stderr_reader.start()
+
+        data = bytearray()
+        spill = None
+        try:
+            for block in iter(lambda: proc.stdout.read(_READ_BLOCK), b""):
+                if spill is None and len(data) + len(block) > memmap_threshold:
+                    spill = tempfile.NamedTemporaryFile(prefix="genlyrics_audio_", suffix=".f32",
+                                                        delete=False)
+                    spill.write(data)
+                    data = None
+                if spill is None:
+                    data += block
+                else:
+                    spill.write(block)
+        except BaseException:
+            # e.g. a full disk or a cancelled job: nobody reads ffmpeg's
+            # stdout any more, so it has to be stopped rather than waited for
+            proc.kill()
+            proc.wait()
+            stderr_reader.join()
+            if spill is not None:
+                spill.close()
+                _remove(spill.name)
+            raise
+        finally:
+            proc.stdout.close()
+        returncode = proc.wait()
+        stderr_reader.join()
+        if spill is not None:
+            spill.close()
+
+        if returncode != 0:
+            if spill is not None:
+                _remove(spill.name)
+            message = b"".join(errors).decode(errors='replace').strip()
+            raise RuntimeError(f"Failed to decode {path}: {message}")
+
+        frame_bytes = 4 * channels
+        if spill is None:
+            n_frames = len(data) // frame_bytes
+            samples = np.frombuffer(data, np.float32, n_frames * channels).reshape(n_frames, channels)
+            buffer = AudioBuffer(samples, sample_rate)
+        else:
+            n_frames = os.path.getsize(spill.name) // frame_bytes
+            samples = np.memmap(spill.name, np.float32, mode='r', shape=(n_frames, channels))
+            buffer = AudioBuffer(samples, sample_rate, temp_path=spill.name)
+            count("audio_memmapped")
+
+    count("audio_decoded_s", round(buffer.duration, 1))
+    return buffer
+
+def stream_audio(path, window, overlap=0.0, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """
+    Decodes a file in one ffmpeg pass and yields it in windows of `window`
+    seconds as (start_seconds, samples), samples shaped (n, channels).
+    Consecutive windows share `overlap` seconds. Only one window is held at
+    a time, so memory does not grow with the length of the file.
+    """
+    window_len = int(window * sample_rate)
+    hop = window_len - int(overlap * sample_rate)
+    if hop <= 0:
+        raise ValueError("overlap must be shorter than the window")
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '0', '-i', path,
+           '-f', 'f32le', '-ac', str(channels), '-ar', str(sample_rate), '-']
+    frame_bytes = 4 * channels
+
+    # stderr goes to a temp file: nothing reads it until ffmpeg is done
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            pending = np.zeros((0, channels), dtype=np.float32)
+            start = 0
+            exhausted = False
+            while not exhausted:
+                data = proc.stdout.read((window_len - len(pending)) * frame_bytes)
+                exhausted = len(data) < (window_len - len(pending)) * frame_bytes
+                n_frames = len(data) // frame_bytes
+                block = np.frombuffer(data, np.float32, n_frames * channels).reshape(n_frames, channels)
+                samples = np.concatenate([pending, block])
+                # The last window may be short; an empty one is only yielded for an empty file
+                if len(samples) > len(pending) or start == 0:
+                    count("audio_windows")
+                    yield start / sample_rate, samples
+                pending = samples[hop:].copy()
+                start += hop
+            returncode = proc.wait()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdout.close()
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()
+            raise RuntimeError(f"Failed to decode {path}: {message}")
+
+class WavWriter:
+    """
+    Writes float32 samples, shaped (n, channels), to a 16-bit PCM WAV file
+    block by block (the same format the Demucs CLI saves stems in).
+    """
+
+    def __init__(self, path, sample_rate, channels):
+        import wave
+
+        self.path = path
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+
+    def write(self, samples):
+        # Same scaling as Demucs' save_audio; NaN would cast to arbitrary samples
+        samples = np.nan_to_num(np.asarray(samples, dtype=np.float32), nan=0.0, posinf=1.0, neginf=-1.0)
+        pcm = np.clip(samples * 2 ** 15, -2 ** 15, 2 ** 15 - 1).astype('<i2')
+        self._wav.writeframes(pcm.tobytes())
+
+    def close(self):
+        self._wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def resample(audio, src_rate, dst_rate):
+    """
+    Resamples 1-D float32 audio in memory.
+    Uses julius (installed with Demucs) when available, otherwise pipes
+    the samples through ffmpeg's resampler - the same one Whisper's own
+    loader uses - without touching the disk.
+    """
+    if src_rate == dst_rate:
+        return np.ascontiguousarray(audio, dtype=np.float32)
+
+    with span("audio_resample"):
+        try:
+            import torch
+            import julius
+        except ImportError:
+            return _resample_ffmpeg(audio, src_rate, dst_rate)
+        with torch.no_grad():
+            out = julius.resample_frac(torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)),
+                                       src_rate, dst_rate)
+        return out.numpy()
+
+def _resample_ffmpeg(audio, src_rate, dst_rate):
+    # audio: one array, or an iterable of consecutive blocks
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error',
+           '-f', 'f32le', '-ac', '1', '-ar', str(src_rate), '-i', '-',
+           '-f', 'f32le', '-ac', '1', '-ar', str(dst_rate), '-']
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+
+    def feed():
+        blocks = [audio] if isinstance(audio, np.ndarray) else audio
+        try:
+            for block in blocks:
+                proc.stdin.write(memoryview(np.ascontiguousarray(block, dtype=np.float32)).cast('B'))
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+
+    # Write from a thread while reading here, or both pipes can fill up
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    out = proc.stdout.read()
+    writer.join()
+    if proc.wait() != 0:
+        raise RuntimeError("ffmpeg resample failed")
+    return np.frombuffer(out, np.float32).copy()
+
+# Decoded buffers shared between pipeline stages, keyed by file path.
+# Small LRU: a batch run only has a few songs in flight at once.
+_BUFFERS = OrderedDict()
+_BUFFERS_LOCK = threading.Lock()
+MAX_BUFFERS = 4
+
+def _buffer_key(path):
+    return os.path.abspath(path)
+
+def register_audio(path, buffer):
+    """
+    Makes an already-decoded buffer the content of path for load_audio,
+    e.g. the vocals a separator just wrote out.
+    """
+    with _BUFFERS_LOCK:
+        _BUFFERS[_buffer_key(path)] = buffer
+        _BUFFERS.move_to_end(_buffer_key(path))
+        while len(_BUFFERS) > MAX_BUFFERS:
+            _BUFFERS.popitem(last=False)
+
+def load_audio(path):
+    """
+    The decoded buffer for path, decoding it only if no stage has yet.
+    """
+    key = _buffer_key(path)
+    with _BUFFERS_LOCK:
+        if key in _BUFFERS:
+            _BUFFERS.move_to_end(key)
+            count("audio_buffer_hits")
+            return _BUFFERS[key]
+    buffer = decode_audio(path)
+    register_audio(path, buffer)
+    return buffer
+
+def loaded_audio(path):
+    """
+    The buffer for path if some stage already decoded it, else None.
+    """
+    with _BUFFERS_LOCK:
+        return _BUFFERS.get(_buffer_key(path))
+
+def alias_audio(old_path, new_path):
+    """
+    Follows a file that was moved (e.g. into the artifact cache).
+    """
+    with _BUFFERS_LOCK:
+        buffer = _BUFFERS.pop(_buffer_key(old_path), None)
+    if buffer is not None:
+        register_audio(new_path, buffer)
+
+def release_audio(path):
+    with _BUFFERS_LOCK:
+        _BUFFERS.pop(_buffer_key(path), None)
+
+def probe_audio_codec(path):
+    """
+    Codec name of the first audio stream, or None if it can't be probed.
+    """
+    if not shutil.which('ffprobe'):
+        return None
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+           '-show_entries', 'stream=codec_name', '-of', 'json', path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        streams = json.loads(result.stdout).get('streams') or []
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+    return streams[0].get('codec_name') if streams else None
+
+def mux_audio_args(audio_path, codec="aac", bitrate="192k"):
+    """
+    ffmpeg output args for the audio track of an MP4.
+    The source stream is copied when MP4 can hold it, so compressed
+    downloads are not transcoded a second time.
+    """
+    if probe_audio_codec(audio_path) in MP4_AUDIO_CODECS:
+        return ['-c:a', 'copy']
+    return ['-c:a', codec, '-b:a', bitrate]
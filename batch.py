@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import time
+import queue
+import threading
+import traceback
+from audio_fetcher import list_playlist
+from pipeline import fetch_audio, separate_vocals, transcribe
+from renderer import create_lyrics_video
+from tracing import Tracer, use_tracer, span, profiled
+
+class BatchJob:
+    """
+    One song moving through the batch pipeline.
+    """
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.title = None
+        self.audio_path = None
+        self.vocals_path = None
+        self.segments = None
+        self.output_path = None
+        self.error = None
+        self.failed_stage = None
+        # stage name -> seconds spent
+        self.timings = {}
+        self.tracer = Tracer(f"job-{index}")
+        self.trace_path = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def report(self):
+        return {
+            'index': self.index,
+            'source': self.source,
+            'title': self.title,
+            'status': 'ok' if self.ok else 'failed',
+            'failed_stage': self.failed_stage,
+            'error': self.error,
+            'output': self.output_path,
+            'timings': self.timings,
+            'trace': self.trace_path,
+            'breakdown': self.tracer.summary(),
+        }
+
+def expand_sources(source, use_cookies=False):
+    """
+    Turns a batch source into a list of URLs / local audio paths.
+    source is a text file (one URL or path per line, # for comments),
+    a playlist URL, or a single URL.
+    """
+    if os.path.isfile(source):
+        with open(source) as f:
+            lines = [line.strip() for line in f]
+        return [line for line in lines if line and not line.startswith('#')]
+    return list_playlist(source, use_cookies=use_cookies)
+
+class _Stage:
+    """
+    A pool of threads that takes jobs from inbox, runs func on them and
+    passes them on. Failed jobs skip the remaining stages but still flow
+    through to the end so they show up in the report.
+    """
+
+    def __init__(self, name, func, workers, inbox, outbox, profile_dir=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.func = func
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def finish(self):
+        """
+        Tells every worker there is no more input and waits for them.
+        """
+        for _ in self.threads:
+            self.inbox.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self.inbox.get()
+            if job is None:
+                break
+            if job.ok:
+                started = time.perf_counter()
+                profile_path = None
+                if self.profile_dir:
+                    profile_path = os.path.join(self.profile_dir, f"{job.index:03d}_{self.name}.prof")
+                try:
+                    with use_tracer(job.tracer), span(self.name), profiled(profile_path):
+                        self.func(job)
+                except Exception as e:
+                    job.error = f"{type(e).__name__}: {e}"
+                    job.failed_stage = self.name
+                    traceback.print_exc()
+                    print(f"[{self.name}] job {job.index} failed: {job.error}")
+                job.timings[self.name] = round(time.perf_counter() - started, 3)
+            self.outbox.put(job)
+
+def _safe_name(title):
+    return re.sub(r'[^\w\-]+', '_', title or 'song').strip('_')[:80] or 'song'
+
+def run_batch(sources, output_dir="./output", cache=None, use_cookies=False,
+              download_workers=2, ml_workers=1, render_workers=1, render_processes=1,
+              queue_size=2, model_size="medium", vad_workers=0, karaoke_wipe=False, backend="frames",
+              sidecars=False, trace=True, profile=False):
+    """
+    Runs download -> separate/transcribe -> render for many songs with the
+    stages overlapped: song N+1 downloads while song N transcribes and song
+    N-1 renders. Each stage has its own worker count, stages are linked by
+    bounded queues (queue_size) so fast stages cannot run far ahead, and a
+    failure only affects its own job. With ml_workers > 1 one song can be
+    separated while another is transcribed; transcriptions share the loaded
+    Whisper model and take turns on it (see lyrics_engine.inference_lock).
+    karaoke_wipe, backend and sidecars go to create_lyrics_video.
+    Every job is traced (trace=True): a Chrome trace per job goes to
+    output_dir/traces and the timing breakdown into the report. profile=True
+    also dumps cProfile stats per job and stage.
+    Returns the report dict, also written to output_dir/batch_report.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [BatchJob(i, source) for i, source in enumerate(sources)]
+    trace_dir = os.path.join(output_dir, "traces")
+    if trace or profile:
+        os.makedirs(trace_dir, exist_ok=True)
+    profile_dir = trace_dir if profile else None
+
+    def download(job):
+        if os.path.isfile(job.source):
+            job.audio_path = job.source
+            job.title = os.path.splitext(os.path.basename(job.source))[0]
+        else:
+            job.audio_path, job.title = fetch_audio(job.source, cache, use_cookies=use_cookies)
+
+    def separate_and_transcribe(job):
+        job.vocals_path = separate_vocals(job.audio_path, cache)
+        job.segments = transcribe(job.vocals_path, cache, model_size=model_size,
+                                  vad_workers=vad_workers)
+
+    def render(job):
+        job.output_path = os.path.join(output_dir, f"{job.index:03d}_{_safe_name(job.title)}.mp4")
+        create_lyrics_video(job.audio_path, job.segments, output_path=job.output_path,
+                            workers=render_processes, karaoke_wipe=karaoke_wipe, backend=backend,
+                            sidecars=sidecars)
+
+    q_download = queue.Queue()
+    q_ml = queue.Queue(maxsize=queue_size)
+    q_render = queue.Queue(maxsize=queue_size)
+    q_done = queue.Queue()
+
+    stages = [
+        _Stage("download", download, download_workers, q_download, q_ml, profile_dir),
+        _Stage("transcribe", separate_and_transcribe, ml_workers, q_ml, q_render, profile_dir),
+        _Stage("render", render, render_workers, q_render, q_done, profile_dir),
+    ]
+
+    started = time.perf_counter()
+    for stage in stages:
+        stage.start()
+    for job in jobs:
+        q_download.put(job)
+    # Close the stages in order; each one drains before the next is told to stop
+    for stage in stages:
+        stage.finish()
+    wall_time = time.perf_counter() - started
+
+    if trace:
+        for job in jobs:
+            job.trace_path = os.path.join(trace_dir, f"{job.index:03d}_{_safe_name(job.title or job.source)}.trace.json")
+            job.tracer.export_chrome(job.trace_path)
+
+    failed = [job for job in jobs if not job.ok]
+    report = {
+        'total': len(jobs),
+        'succeeded': len(jobs) - len(failed),
+        'failed': len(failed),
+        'wall_time': round(wall_time, 3),
+        'stage_time': {stage.name: round(sum(job.timings.get(stage.name, 0) for job in jobs), 3)
+                       for stage in stages},
+        'jobs': [job.report() for job in jobs],
+    }
+
+    report_path = os.path.join(output_dir, "batch_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n--- Batch done in {wall_time:.1f}s: {report['succeeded']}/{report['total']} succeeded ---")
+    for job in failed:
+        print(f"  FAILED #{job.index} [{job.failed_stage}] {job.source}: {job.error}")
+    print(f"Report: {report_path}")
+    return report
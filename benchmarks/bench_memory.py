@@ -0,0 +1,219 @@
+"""
+Memory benchmark: peak RSS per stage, whole-track vs streaming, on
+synthetic tracks of growing length.
+
+    python benchmarks/bench_memory.py --minutes 3 30 180 --output memory.json
+    python benchmarks/bench_memory.py --compare before.json after.json
+
+Every measurement runs in a fresh interpreter and reports that process's
+peak RSS (ffmpeg children are not counted). Stages:
+    render      frame loop and encode of synthetic lyrics (needs ffmpeg)
+    decode      audio decode to Whisper's 16 kHz mono (needs ffmpeg)
+    separate    Demucs vocals separation (needs ffmpeg and demucs)
+    transcribe  Whisper transcription (needs ffmpeg and whisper)
+Stages whose dependencies are missing are reported as skipped. With
+streaming, peak RSS should be about the same for every length.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ("render", "decode", "separate", "transcribe")
+MODES = ("full", "stream")
+# Synthetic audio: 16 kHz mono keeps the files small for hour-long tracks
+AUDIO_RATE = 16000
+
+def _peak_rss_mb():
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024, 1)
+
+def _missing(stage):
+    """
+    Why a stage can't run here, or None.
+    """
+    if shutil.which("ffmpeg") is None:
+        return "ffmpeg not found"
+    module = {"separate": "demucs", "transcribe": "whisper"}.get(stage)
+    if module and importlib.util.find_spec(module) is None:
+        return f"{module} not installed"
+    return None
+
+def make_audio(path, minutes):
+    """
+    Writes `minutes` of quiet noise as a WAV file, a minute at a time.
+    """
+    import numpy as np
+    from audio_io import WavWriter
+
+    rng = np.random.default_rng(0)
+    with WavWriter(path, AUDIO_RATE, 1) as out:
+        for _ in range(int(minutes)):
+            out.write(rng.normal(0, 0.05, (AUDIO_RATE * 60, 1)).astype(np.float32))
+    return path
+
+def _run_render(mode, minutes, work_dir, config):
+    from renderer import create_lyrics_video, create_stream_video
+    from benchmarks.synthetic import SCENARIOS, iter_segments, make_segments
+
+    shape = dict(SCENARIOS["long_dense"], duration=minutes * 60)
+    options = {'resolution': tuple(config['resolution']), 'fps': config['fps'], 'preset': "ultrafast",
+               'on_progress': lambda event: None}
+    output_path = os.path.join(work_dir, f"render_{mode}.mp4")
+    if mode == "full":
+        create_lyrics_video(None, make_segments(**shape), output_path, **options)
+    else:
+        create_stream_video(None, iter_segments(**shape), output_path, **options)
+
+def _run_decode(mode, minutes, work_dir, config):
+    from audio_io import load_audio, stream_audio, WHISPER_SAMPLE_RATE
+    from lyrics_engine import TRANSCRIBE_WINDOW, TRANSCRIBE_OVERLAP
+
+    if mode == "full":
+        load_audio(config['audio_path']).whisper_audio()
+    else:
+        for _ in stream_audio(config['audio_path'], TRANSCRIBE_WINDOW, TRANSCRIBE_OVERLAP,
+                              WHISPER_SAMPLE_RATE, channels=1):
+            pass
+
+def _run_separate(mode, minutes, work_dir, config):
+    from lyrics_engine import isolate_vocals
+
+    isolate_vocals(config['audio_path'], output_dir=os.path.join(work_dir, f"separated_{mode}"),
+                   stream=(mode == "stream"))
+
+def _run_transcribe(mode, minutes, work_dir, config):
+    from lyrics_engine import transcribe_with_lyrics, transcribe_windows
+
+    if mode == "full":
+        transcribe_with_lyrics(config['audio_path'], model_size=config['model'])
+    else:
+        for _ in transcribe_windows(config['audio_path'], model_size=config['model']):
+            pass
+
+RUNNERS = {
+    "render": _run_render,
+    "decode": _run_decode,
+    "separate": _run_separate,
+    "transcribe": _run_transcribe,
+}
+
+def child(spec):
+    """
+    Runs one measurement in this (fresh) process and prints its result.
+    """
+    import numpy  # noqa: F401  (part of the baseline, not of the stage)
+
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    RUNNERS[spec['stage']](spec['mode'], spec['minutes'], spec['work_dir'], spec['config'])
+    print(json.dumps({
+        'peak_rss_mb': _peak_rss_mb(),
+        'baseline_rss_mb': baseline,
+        'seconds': round(time.perf_counter() - started, 2),
+    }))
+
+def measure(stage, mode, minutes, work_dir, config):
+    spec = {'stage': stage, 'mode': mode, 'minutes': minutes, 'work_dir': work_dir, 'config': config}
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def run(stages, minutes_list, config):
+    from benchmarks.bench_renderer import _git_commit
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_bench_mem_")
+    try:
+        results = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'minutes': minutes_list,
+            'config': dict(config),
+            'stages': {},
+        }
+        audio_paths = {}
+        for stage in stages:
+            missing = _missing(stage)
+            if missing:
+                print(f"{stage}: skipped ({missing})", flush=True)
+                results['stages'][stage] = {'skipped': missing}
+                continue
+            stage_results = results['stages'][stage] = {}
+            for mode in MODES:
+                stage_results[mode] = {}
+                for minutes in minutes_list:
+                    if stage != "render" and minutes not in audio_paths:
+                        audio_paths[minutes] = make_audio(os.path.join(work_dir, f"audio_{minutes}.wav"),
+                                                          minutes)
+                    stage_config = dict(config, audio_path=audio_paths.get(minutes))
+                    print(f"{stage} {mode} {minutes} min...", end=" ", flush=True)
+                    result = measure(stage, mode, minutes, work_dir, stage_config)
+                    stage_results[mode][str(minutes)] = result
+                    print(result.get('error') or f"{result['peak_rss_mb']} MB peak", flush=True)
+                peaks = [r['peak_rss_mb'] for r in stage_results[mode].values() if 'peak_rss_mb' in r]
+                if len(peaks) == len(minutes_list) and len(peaks) > 1:
+                    # How much the peak grows from the shortest to the longest track
+                    stage_results[mode]['growth_mb'] = round(peaks[-1] - peaks[0], 1)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'stage':<11} {'mode':<7} {'minutes':>7} {'before MB':>10} {'after MB':>9}")
+    for stage, modes in after['stages'].items():
+        for mode in MODES:
+            for minutes, a in modes.get(mode, {}).items():
+                if not isinstance(a, dict) or 'peak_rss_mb' not in a:
+                    continue
+                b = before['stages'].get(stage, {}).get(mode, {}).get(minutes, {})
+                print(f"{stage:<11} {mode:<7} {minutes:>7} {b.get('peak_rss_mb', '-'):>10} {a['peak_rss_mb']:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark")
+    parser.add_argument("--stage", action="append", choices=STAGES, help="Stage to run (repeatable, default: all)")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[3, 30, 180], help="Track lengths to measure")
+    parser.add_argument("--resolution", type=str, default="640x360", help="Render resolution (WxH)")
+    parser.add_argument("--fps", type=int, default=10, help="Render frame rate")
+    parser.add_argument("--model", type=str, default="tiny", help="Whisper model for the transcribe stage")
+    parser.add_argument("--output", type=str, help="Write results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    config = {'resolution': [int(v) for v in args.resolution.split("x")], 'fps': args.fps, 'model': args.model}
+    results = run(args.stage or list(STAGES), sorted(args.minutes), config)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
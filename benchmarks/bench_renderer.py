@@ -0,0 +1,201 @@
+"""
+Renderer benchmark: synthetic songs, per-stage timings, JSON results.
+
+    python benchmarks/bench_renderer.py --output before.json
+    python benchmarks/bench_renderer.py --output after.json
+    python benchmarks/bench_renderer.py --compare before.json after.json
+
+Runs offline. The encode stage uses ffmpeg when it is on PATH and is
+skipped otherwise (encode_measured: false).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import PIL
+from renderer import FrameRenderer, wrap_text_pil, _total_frames, FPS
+from video_encoder import FFmpegWriter
+from benchmarks.synthetic import SCENARIOS, make_segments, make_font_file, make_background
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+def bench_wrap(font_path, repeats=200):
+    """
+    Micro-benchmark of wrap_text_pil on a short and a long line.
+    """
+    renderer = FrameRenderer([], font_path=font_path)
+    results = {}
+    for name, n_words in (("short_line", 6), ("long_line", 30)):
+        text = ' '.join(["remember"] * n_words)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            wrap_text_pil(text, renderer.font, renderer.max_text_width)
+        results[name] = round((time.perf_counter() - started) / repeats * 1000, 4)
+    return {'ms_per_call': results}
+
+def _peak_alloc_mb(segments, font_path, bg_path, karaoke_wipe=False):
+    """
+    Peak Python allocations of the same render, without the encode. A pass
+    of its own: tracing slows allocation-heavy stages down several times, so
+    it can't share a pass with the timings.
+    """
+    tracemalloc.start()
+    try:
+        renderer = FrameRenderer(segments, bg_image_path=bg_path, font_path=font_path,
+                                 karaoke_wipe=karaoke_wipe)
+        for state, _, _ in renderer.timing.state_runs(FPS, _total_frames(segments, FPS)):
+            if state is not None:
+                renderer.layout(state[0])
+            renderer.render_state(state)
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak_traced / 1024 ** 2, 1)
+
+def bench_scenario(segments, font_path, bg_path, encode, work_dir, karaoke_wipe=False):
+    timings = {'setup': 0.0, 'timing': 0.0, 'layout': 0.0, 'draw': 0.0, 'encode': 0.0}
+
+    started = time.perf_counter()
+    renderer = FrameRenderer(segments, bg_image_path=bg_path, font_path=font_path,
+                             karaoke_wipe=karaoke_wipe)
+    timings['setup'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    total_frames = _total_frames(segments, FPS)
+    runs = renderer.timing.state_runs(FPS, total_frames)
+    timings['timing'] = time.perf_counter() - started
+
+    writer = None
+    if encode:
+        writer = FFmpegWriter(os.path.join(work_dir, "bench.mp4"), renderer.width,
+                              renderer.height, FPS, preset="veryfast")
+
+    for state, _, n_frames in runs:
+        if state is not None:
+            t0 = time.perf_counter()
+            renderer.layout(state[0])
+            timings['layout'] += time.perf_counter() - t0
+
+        # Drawing includes restoring the previous state's text box
+        t0 = time.perf_counter()
+        frame_bgr = renderer.render_state(state)
+        timings['draw'] += time.perf_counter() - t0
+
+        if writer:
+            t0 = time.perf_counter()
+            for _ in range(n_frames):
+                writer.write(frame_bgr)
+            timings['encode'] += time.perf_counter() - t0
+
+    if writer:
+        t0 = time.perf_counter()
+        writer.close()
+        timings['encode'] += time.perf_counter() - t0
+
+
+    render_time = sum(timings.values())
+    return {
+        'segments': len(segments),
+        'words': sum(len(seg['words']) for seg in segments),
+        'frames': total_frames,
+        'unique_states': len(runs),
+        'seconds': {k: round(v, 4) for k, v in timings.items()},
+        'ms_per_frame': {k: round(v / total_frames * 1000, 4) for k, v in timings.items()},
+        'ms_per_state': {k: round(timings[k] / len(runs) * 1000, 4)
+                         for k in ('layout', 'draw')},
+        'frames_per_sec': round(total_frames / render_time, 1),
+        'encode_measured': bool(encode),
+        'peak_python_alloc_mb': _peak_alloc_mb(segments, font_path, bg_path, karaoke_wipe),
+    }
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024, 1)
+
+def run(scenarios, encode, font_path=None, karaoke_wipe=False):
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_bench_")
+    try:
+        font_path = font_path or make_font_file(work_dir)
+        bg_path = make_background(work_dir)
+        results = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'karaoke_wipe': karaoke_wipe,
+            'wrap_text_pil': bench_wrap(font_path),
+            'scenarios': {},
+        }
+        for name in scenarios:
+            segments = make_segments(**SCENARIOS[name])
+            print(f"{name}: {len(segments)} segments...", flush=True)
+            results['scenarios'][name] = bench_scenario(segments, font_path, bg_path, encode, work_dir,
+                                                        karaoke_wipe)
+            print(f"  {results['scenarios'][name]['frames_per_sec']} frames/sec", flush=True)
+        results['peak_rss_mb'] = _peak_rss_mb()
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'scenario':<14} {'before fps':>11} {'after fps':>10} {'speedup':>8}")
+    for name, a in after['scenarios'].items():
+        b = before['scenarios'].get(name)
+        if not b:
+            continue
+        speedup = a['frames_per_sec'] / b['frames_per_sec'] if b['frames_per_sec'] else float('nan')
+        print(f"{name:<14} {b['frames_per_sec']:>11} {a['frames_per_sec']:>10} {speedup:>7.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Renderer benchmark")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--font", type=str, help="Font file (default: Pillow's bundled font)")
+    parser.add_argument("--no-encode", action="store_true", help="Skip the ffmpeg encode stage")
+    parser.add_argument("--karaoke-wipe", action="store_true", help="Render with the karaoke wipe")
+    parser.add_argument("--output", type=str, help="Write results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    encode = not args.no_encode and shutil.which("ffmpeg") is not None
+    results = run(args.scenario or list(SCENARIOS), encode, args.font, args.karaoke_wipe)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
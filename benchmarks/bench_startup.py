@@ -0,0 +1,150 @@
+"""
+Startup benchmark: cold import time of the entry points and, when
+Streamlit is installed, app.py's first run and rerun latency.
+
+    python benchmarks/bench_startup.py --output before.json
+    python benchmarks/bench_startup.py --output after.json
+    python benchmarks/bench_startup.py --compare before.json after.json
+
+Every cold measurement runs in a fresh interpreter. Results also list
+which heavy libraries (torch, whisper, cv2, ...) each import pulled in;
+after startup none of them should be loaded.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules the entry points import at startup
+MODULES = ["main", "batch", "pipeline", "renderer", "job_queue", "font_manager", "subtitles"]
+# Libraries that should only load once their stage runs
+HEAVY = ["torch", "whisper", "demucs", "cv2", "yt_dlp", "requests", "julius"]
+
+_IMPORT_PROBE = """
+import sys, json, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - started,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_APP_PROBE = """
+import sys, json, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+started = time.perf_counter()
+at.run()
+first = time.perf_counter() - started
+reruns = []
+for _ in range({reruns}):
+    started = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - started)
+print(json.dumps({{'first_run_seconds': first, 'rerun_seconds': reruns,
+                  'exceptions': [str(e.value) for e in at.exception],
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+def _probe(code, cwd=ROOT):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=cwd)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench_import(module, repeats=5):
+    """
+    Median wall time of `import module` in a fresh interpreter.
+    """
+    runs = [_probe(_IMPORT_PROBE.format(root=ROOT, module=module, heavy=HEAVY)) for _ in range(repeats)]
+    if any('error' in run for run in runs):
+        return {'error': next(run['error'] for run in runs if 'error' in run)}
+    return {
+        'median_ms': round(statistics.median(run['seconds'] for run in runs) * 1000, 1),
+        'heavy_loaded': runs[0]['heavy'],
+    }
+
+def bench_app(reruns=5):
+    """
+    app.py under Streamlit's AppTest: the first (cold) script run and the
+    latency of plain reruns, which is what every widget interaction costs.
+    """
+    try:
+        import streamlit  # noqa: F401
+    except ImportError:
+        return {'error': "streamlit not installed"}
+    run = _probe(_APP_PROBE.format(root=ROOT, app=os.path.join(ROOT, "app.py"),
+                                   reruns=reruns, heavy=HEAVY))
+    if 'error' in run:
+        return run
+    return {
+        'first_run_ms': round(run['first_run_seconds'] * 1000, 1),
+        'rerun_median_ms': round(statistics.median(run['rerun_seconds']) * 1000, 1),
+        'exceptions': run['exceptions'],
+        'heavy_loaded': run['heavy'],
+    }
+
+def run(modules, repeats=5, reruns=5):
+    results = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'imports': {},
+    }
+    for module in modules:
+        results['imports'][module] = bench_import(module, repeats)
+        print(f"import {module}: {results['imports'][module]}", flush=True)
+    results['app'] = bench_app(reruns)
+    print(f"app.py: {results['app']}", flush=True)
+    return results
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'import':<14} {'before ms':>10} {'after ms':>9}")
+    for name, a in after['imports'].items():
+        b = before['imports'].get(name, {})
+        print(f"{name:<14} {b.get('median_ms', '-'):>10} {a.get('median_ms', '-'):>9}")
+    for key in ('first_run_ms', 'rerun_median_ms'):
+        print(f"app {key:<10} {before.get('app', {}).get(key, '-'):>10} {after.get('app', {}).get(key, '-'):>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--module", action="append", help="Module to time (repeatable, default: entry points)")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per import")
+    parser.add_argument("--reruns", type=int, default=5, help="app.py reruns to time")
+    parser.add_argument("--output", type=str, help="Write results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args.module or MODULES, args.repeats, args.reruns)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Synthetic songs, fonts and backgrounds so benchmarks run fully offline.
+"""
+import os
+import random
+import numpy as np
+from PIL import Image, ImageFont
+
+VOCAB = ("love night baby dance heart fire tonight forever dream light "
+         "never gonna stop believe higher together falling burning "
+         "remember everything somewhere electric midnight").split()
+
+# name -> song shape
+SCENARIOS = {
+    # Short pop song, a word every ~0.35 s, short lines
+    "short_dense": {"duration": 30, "words_per_line": (4, 8), "word_time": 0.35, "gap": 0.4},
+    # Full-length song with long instrumental gaps
+    "long_sparse": {"duration": 240, "words_per_line": (3, 6), "word_time": 0.5, "gap": 6.0},
+    # Full-length song, fast delivery
+    "long_dense": {"duration": 240, "words_per_line": (6, 12), "word_time": 0.25, "gap": 0.3},
+    # Lines long enough to wrap over two or three rows
+    "long_lines": {"duration": 120, "words_per_line": (18, 30), "word_time": 0.3, "gap": 0.5},
+}
+
+def make_segments(duration, words_per_line, word_time, gap, seed=0):
+    """
+    Whisper-shaped segments with word timings filling `duration` seconds.
+    """
+    return list(iter_segments(duration, words_per_line, word_time, gap, seed))
+
+def iter_segments(duration, words_per_line, word_time, gap, seed=0):
+    """
+    make_segments one segment at a time, for streamed renders.
+    """
+    rng = random.Random(seed)
+    n_segments = 0
+    t = 1.0
+    while True:
+        n_words = rng.randint(*words_per_line)
+        if t + n_words * word_time > duration:
+            break
+        words = []
+        for _ in range(n_words):
+            length = word_time * rng.uniform(0.6, 0.95)
+            words.append({'word': ' ' + rng.choice(VOCAB), 'start': round(t, 2), 'end': round(t + length, 2)})
+            t += word_time
+        yield {
+            'id': n_segments,
+            'start': words[0]['start'],
+            'end': words[-1]['end'],
+            'text': ''.join(w['word'] for w in words),
+            'words': words,
+        }
+        n_segments += 1
+        t += gap
+
+def make_font_file(work_dir):
+    """
+    Writes Pillow's bundled TrueType font to disk so the renderer can load it by path.
+    """
+    path = os.path.join(work_dir, "bench_font.ttf")
+    with open(path, "wb") as f:
+        f.write(ImageFont.load_default(60).font_bytes)
+    return path
+
+def make_background(work_dir, size=(1920, 1080)):
+    """
+    Writes a noisy gradient background (noise keeps PNG decode/resize honest).
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, width)[None, :, None]
+    y = np.linspace(0, 1, height)[:, None, None]
+    channels = [x * 180 + 40 * y, y * 120 + 30 + 0 * x, (1 - x) * 200 + 20 * y]
+    img = np.concatenate(channels, axis=2)
+    img = img + rng.normal(0, 6, img.shape)
+    path = os.path.join(work_dir, "bench_bg.png")
+    Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(path)
+    return path
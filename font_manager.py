@@ -1,7 +1,12 @@
 import os
-import requests
-import zipfile
-import io
+import re
+import sys
+import json
+import hashlib
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageFont
 
 # Curated list of high-quality Google Fonts
 GOOGLE_FONTS = {
@@ -31,69 +36,267 @@ GOOGLE_FONTS = {
 }
 
 FONT_DIR = "./fonts"
+# Overridable so the store can be pointed at a local mirror / test server
+GOOGLE_FONTS_CSS_URL = os.environ.get("GENLYRICS_FONTS_CSS_URL", "https://fonts.googleapis.com/css2")
+# (connect, read) seconds
+HTTP_TIMEOUT = (5, 30)
+
+def _normalize(font_name):
+    return font_name.replace(" ", "")
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class FontStore:
+    """
+    Local store of downloaded font files.
+    fonts/manifest.json maps each family to its file, SHA-256 and source
+    URL, so lookups are exact (no substring matching) and need no directory
+    scan. Downloads share one pooled HTTP session with timeouts.
+    """
+
+    def __init__(self, font_dir=FONT_DIR, css_url=GOOGLE_FONTS_CSS_URL, timeout=HTTP_TIMEOUT):
+        self.font_dir = font_dir
+        self.css_url = css_url
+        self.timeout = timeout
+        self.manifest_path = os.path.join(font_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._session = None
+        self._manifest = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            # Only imported once something has to be downloaded
+            import requests
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def manifest(self):
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = {}
+                if os.path.exists(self.manifest_path):
+                    try:
+                        with open(self.manifest_path) as f:
+                            self._manifest = json.load(f)
+                    except (OSError, ValueError):
+                        print("Font manifest unreadable, rebuilding.")
+            return self._manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.font_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _record(self, font_name, path, url=None):
+        digest = _sha256(path)
+        manifest = self.manifest()
+        with self._lock:
+            manifest[font_name] = {
+                "file": os.path.basename(path),
+                "sha256": digest,
+                "size": os.path.getsize(path),
+                "url": url,
+            }
+            self._save_manifest()
+
+    def lookup(self, font_name):
+        """
+        Path of a stored font, or None. Never touches the network.
+        A file that no longer matches its manifest hash is removed, so the
+        next get() downloads it again.
+        """
+        entry = self.manifest().get(font_name)
+        if entry:
+            path = os.path.join(self.font_dir, entry["file"])
+            if os.path.exists(path):
+                # Fonts are small and callers memoise the path, so hashing here is cheap
+                if os.path.getsize(path) == entry["size"] and _sha256(path) == entry["sha256"]:
+                    return path
+                print(f"{font_name}: {path} does not match the manifest, discarding it.")
+                os.remove(path)
+                return None
+
+        # Files downloaded before the manifest existed: exact name match only
+        normalized = _normalize(font_name)
+        for ext in (".ttf", ".otf", ".woff2"):
+            path = os.path.join(self.font_dir, normalized + ext)
+            if os.path.exists(path):
+                self._record(font_name, path)
+                return path
+        return None
+
+    def download(self, font_name):
+        """
+        Fetches a family via the Google Fonts CSS API and stores it.
+        Returns the path, or None on failure.
+        """
+        print(f"Downloading {font_name}...")
+
+        try:
+            # 1. Get CSS
+            # No specific User-Agent gets us TTF usually
+            r = self.session.get(self.css_url, params={"family": font_name}, timeout=self.timeout)
+            r.raise_for_status()
+
+            # 2. Extract TTF URL
+            # Look for 'src: url(https://...)'
+            urls = re.findall(r'url\((https?://[^)]+)\)', r.text)
+
+            if not urls:
+                print("No font URLs found in CSS.")
+                return None
+
+            font_url = urls[0] # Take the first one
+
+            # 3. Download the font file
+            r_font = self.session.get(font_url, timeout=self.timeout)
+            r_font.raise_for_status()
+
+            # Pillow supports WOFF2/OTF/TTF depending on libfreetype version.
+            ext = ".ttf" if "ttf" in font_url else ".woff2"
+            os.makedirs(self.font_dir, exist_ok=True)
+            save_path = os.path.join(self.font_dir, f"{_normalize(font_name)}{ext}")
+
+            # Write then rename so a half-downloaded file is never picked up
+            tmp_path = save_path + ".part"
+            with open(tmp_path, "wb") as f:
+                f.write(r_font.content)
+            os.replace(tmp_path, save_path)
+            # Timestamps are coarse: don't rely on them alone to drop a stale face
+            _load_font_file.cache_clear()
+
+            self._record(font_name, save_path, font_url)
+            print(f"Saved to {save_path}")
+            return save_path
+
+        except Exception as e:
+            print(f"Failed to download font: {e}")
+            return None
+
+    def get(self, font_name):
+        return self.lookup(font_name) or self.download(font_name)
+
+    def prefetch(self, font_names, workers=8):
+        """
+        Downloads every missing family in parallel.
+        Returns {font_name: path or None}.
+        """
+        results = {name: self.lookup(name) for name in font_names}
+        missing = [name for name, path in results.items() if not path]
+        if missing:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results.update(zip(missing, pool.map(self.download, missing)))
+        return results
+
+_default_store = FontStore()
+# font_name -> path, so repeated lookups (every app rerun) skip the manifest
+_font_paths = {}
 
 def get_font_path(category, font_name):
     """
     Downloads the font if not present and returns the path to the .ttf/.otf file.
     Uses Google Fonts CSS API to find the real TTF URL.
     """
-    if not os.path.exists(FONT_DIR):
-        os.makedirs(FONT_DIR)
-        
-    normalized_name = font_name.replace(" ", "")
-    
-    # Check existing files first
-    for f in os.listdir(FONT_DIR):
-        if normalized_name.lower() in f.lower() and f.endswith((".ttf", ".otf")):
-            return os.path.join(FONT_DIR, f)
-            
-    # New strategy: Parse CSS
-    print(f"Downloading {font_name}...")
-    
+    path = _font_paths.get(font_name)
+    if path is None or not os.path.exists(path):
+        path = _default_store.get(font_name)
+        # Failures are not remembered, so the next call retries the download
+        if path:
+            _font_paths[font_name] = path
+    return path
+
+def prefetch_fonts(workers=8):
+    """
+    Fills the font store with every family in GOOGLE_FONTS ahead of time.
+    """
+    names = [name for fonts in GOOGLE_FONTS.values() for name in fonts]
+    return _default_store.prefetch(names, workers=workers)
+
+def load_font(path, size, index=0):
+    """
+    Loaded ImageFont for (path, size), shared within the process. The
+    file's inode and mtime are part of the key, so a font another process
+    downloaded again to the same path is loaded again.
+    """
+    stat = os.stat(path)
+    return _load_font_file(path, (stat.st_ino, stat.st_mtime_ns), size, index)
+
+@functools.lru_cache(maxsize=64)
+def _load_font_file(path, version, size, index):
+    return ImageFont.truetype(path, size, index=index)
+
+def selfcheck():
+    """
+    Runs a FontStore against a local stand-in for the Google Fonts CSS API
+    (no network): download, manifest lookup, re-download of a corrupted
+    file, reload of the new face and prefetch with a missing family.
+    """
+    import shutil
+    import tempfile
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    font_bytes = ImageFont.load_default(40).font_bytes
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            requests_seen.append(url.path)
+            if url.path == "/css2" and parse_qs(url.query).get("family") != ["Missing"]:
+                family = parse_qs(url.query)["family"][0].replace(" ", "")
+                body = f"src: url(http://127.0.0.1:{self.server.server_port}/{family}.ttf)".encode()
+            elif url.path.endswith(".ttf"):
+                body = font_bytes
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    font_dir = tempfile.mkdtemp(prefix="genlyrics_fonts_")
     try:
-        # 1. Get CSS
-        css_url = f"https://fonts.googleapis.com/css2?family={font_name.replace(' ', '+')}"
-        # No specific User-Agent gets us TTF usually, or use a generic one.
-        # Wget/Curl/Python-Requests usually get TTF.
-        r = requests.get(css_url)
-        r.raise_for_status()
-        
-        # 2. Extract TTF URL
-        # Look for 'src: url(https://...)'
-        content = r.text
-        import re
-        # Find all woff2/ttf urls
-        urls = re.findall(r'url\((https?://[^)]+)\)', content)
-        
-        if not urls:
-            print("No font URLs found in CSS.")
-            return None
-            
-        font_url = urls[0] # Take the first one
-        
-        # 3. Download the font file
-        r_font = requests.get(font_url)
-        r_font.raise_for_status()
-        
-        # Save it
-        # Note: Google fonts usually serve WOFF2 to browsers.
-        # Pillow supports WOFF2/OTF/TTF depending on libfreetype version.
-        # Let's save as .ttf or .woff2
-        ext = ".ttf" if "ttf" in font_url else ".woff2"
-        # Force .ttf extension for compatibility if simpler, but woff2 is standard now.
-        # Check if Pillow on this system supports woff2. It usually does for recent versions.
-        
-        filename = f"{normalized_name}{ext}"
-        save_path = os.path.join(FONT_DIR, filename)
-        
-        with open(save_path, "wb") as f:
-            f.write(r_font.content)
-            
-        print(f"Saved to {save_path}")
-        return save_path
-
-    except Exception as e:
-        print(f"Failed to download font: {e}")
-        return None
-        
-    return None
+        store = FontStore(font_dir, css_url=f"http://127.0.0.1:{server.server_port}/css2")
+        path = store.get("Open Sans")
+        assert path and len(requests_seen) == 2, "download"
+        assert FontStore(font_dir).lookup("Open Sans") == path and len(requests_seen) == 2, "manifest lookup"
+        face = load_font(path, 20)
+
+        # Same size, different bytes: must be caught by the hash and fetched again
+        with open(path, "r+b") as f:
+            f.write(b"\0" * 16)
+        assert store.lookup("Open Sans") is None and not os.path.exists(path), "hash mismatch"
+        assert store.get("Open Sans") == path and len(requests_seen) == 4, "re-download"
+        assert load_font(path, 20) is not face, "reload after re-download"
+
+        results = store.prefetch(["Open Sans", "Lato", "Missing"])
+        assert results["Open Sans"] == path and results["Lato"] and results["Missing"] is None, "prefetch"
+        print("Font store OK")
+    finally:
+        server.shutdown()
+        shutil.rmtree(font_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    # python font_manager.py prefetch | selfcheck
+    if sys.argv[1:2] == ["prefetch"]:
+        for name, path in prefetch_fonts().items():
+            print(f"{name:<20} {path or 'FAILED'}")
+    elif sys.argv[1:2] == ["selfcheck"]:
+        selfcheck()
+    else:
+        print("Usage: python font_manager.py prefetch | selfcheck")
@@ -0,0 +1,390 @@
+import os
+import copy
+import time
+import uuid
+import queue
+import shutil
+import signal
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from tracing import Tracer, use_tracer
+
+JOBS_DIR = "./jobs"
+# Worker processes per pool. A pool's size is also its concurrency
+# limit: at most that many of its jobs run at once, the rest wait.
+DEFAULT_LIMITS = {"import": 1, "render": 1}
+# Kinds that run on another kind's pool. Alignment needs the Whisper model
+# the import workers already hold.
+JOB_POOLS = {"align": "import"}
+# Short jobs that go to the front of their pool's queue
+URGENT_KINDS = {"align"}
+# Kinds that are left to finish when cancelled while running, their result
+# dropped: stopping them would stop a worker holding loaded models
+UNINTERRUPTIBLE_KINDS = {"align"}
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class Job:
+    """
+    One submitted job and its last reported status.
+    """
+
+    def __init__(self, kind, params, work_dir):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.work_dir = work_dir
+        self.state = QUEUED
+        self.stage = None
+        # 0..1, or None when the stage can't tell
+        self.progress = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Set when an uninterruptible job is cancelled while it runs
+        self.cancel_requested = False
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'stage': self.stage,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+def _import_job(params, work_dir, report):
+    """
+    source (URL or local audio file) -> audio, vocals and word timings.
+    """
+    import pipeline
+    from artifact_cache import ArtifactCache
+    from lyrics_engine import get_model
+
+    cache = ArtifactCache()
+    model_size = params.get('model_size', "medium")
+    source = params['source']
+
+    if os.path.isfile(source):
+        audio_path, title = source, params.get('title') or os.path.basename(source)
+    else:
+        report("download", 0.0)
+        audio_path, title = pipeline.fetch_audio(source, cache, use_cookies=params.get('use_cookies', False))
+
+    report("separate", 1 / 3)
+    vocals_path = pipeline.separate_vocals(audio_path, cache)
+
+    report("transcribe", 2 / 3)
+    # The model stays loaded in this worker process between jobs
+    segments = pipeline.transcribe(vocals_path, cache, model_size, model=get_model(model_size))
+
+    return {'audio_path': audio_path, 'title': title, 'vocals_path': vocals_path, 'segments': segments}
+
+# create_lyrics_video options that also apply to multi-format renders
+FORMAT_OPTIONS = ('bg_image_path', 'font_path', 'color_active', 'color_inactive',
+                  'karaoke_wipe', 'threads', 'sidecars')
+
+def _render_job(params, work_dir, report):
+    """
+    Renders params['segments'] over params['audio_path'] into the job's
+    directory. With params['formats'] (OUTPUT_PROFILES names) every format
+    is rendered in one pass, to <output_name stem>_<format>.mp4.
+    """
+    from renderer import create_lyrics_video, create_format_videos
+    from subtitles import SUBTITLE_FORMATS
+
+    output_path = os.path.join(work_dir, params.get('output_name', "output.mp4"))
+    options = params.get('options', {})
+
+    def on_progress(event):
+        message = f"{event['fps']:.0f} fps, {event['eta']:.0f}s left" if event['fps'] else None
+        report(event['stage'], event['progress'], message)
+
+    # Cancelling stops this process with SIGTERM -> SystemExit, which
+    # unwinds the render and runs its cleanup (ffmpeg, temp files, partial output)
+    if params.get('formats'):
+        # A multi-format render is one frame loop feeding every encoder; the
+        # subtitle backend, draft size and chunked re-renders don't apply to it
+        unsupported = sorted(key for key in options if key not in FORMAT_OPTIONS)
+        if unsupported:
+            raise ValueError(f"Options not supported with formats: {', '.join(unsupported)}")
+        stem = os.path.splitext(output_path)[0]
+        outputs = [(f"{stem}_{name}.mp4", name) for name in params['formats']]
+        create_format_videos(params['audio_path'], params['segments'], outputs, on_progress=on_progress,
+                             **options)
+        output_path = outputs[0][0]
+        result = {'video_path': output_path, 'videos': {name: path for path, name in outputs}}
+    else:
+        create_lyrics_video(params['audio_path'], params['segments'], output_path,
+                            on_progress=on_progress, **options)
+        result = {'video_path': output_path}
+    if options.get('sidecars'):
+        base = os.path.splitext(output_path)[0]
+        result['subtitles'] = {fmt: f"{base}.{fmt}" for fmt in SUBTITLE_FORMATS}
+    return result
+
+def _align_job(params, work_dir, report):
+    """
+    Re-times edited lines against the vocals stem.
+    params['lines']: [{'index', 'text', 'start', 'end', 'language'}]. Returns the new
+    words per line index, or None for a line that could not be aligned.
+    """
+    from audio_io import load_audio
+    from lyrics_engine import align_words, get_model
+
+    report("align", None)
+    model = get_model(params.get('model_size', "medium"))
+    # Decoded once per worker; later corrections only slice it
+    audio = load_audio(params['vocals_path']).whisper_audio()
+    words = {}
+    for line in params['lines']:
+        try:
+            words[line['index']] = align_words(line['text'], audio, line['start'], line['end'], model=model,
+                                               language=line.get('language'))
+        except ValueError as e:
+            print(f"Could not align line {line['index']}: {e}")
+            words[line['index']] = None
+    return {'lines': params['lines'], 'words': words}
+
+JOB_KINDS = {
+    "import": _import_job,
+    "render": _render_job,
+    "align": _align_job,
+}
+
+def _pool(kind):
+    return JOB_POOLS.get(kind, kind)
+
+def _raise_exit(signum, frame):
+    raise SystemExit(1)
+
+def _worker_loop(pool, inbox, events, warm_up):
+    # Cancelling terminates the worker; turning SIGTERM into SystemExit
+    # unwinds the running job so e.g. an ffmpeg child is killed on the way out
+    signal.signal(signal.SIGTERM, _raise_exit)
+    if warm_up:
+        from lyrics_engine import warm_up as load_model
+        load_model(warm_up)
+
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+        job_id, kind, params, work_dir = task
+
+        def report(stage, progress=None, message=None):
+            events.put(("progress", job_id, {'stage': stage, 'progress': progress, 'message': message}))
+
+        tracer = Tracer(f"{kind}-{job_id}")
+        try:
+            with use_tracer(tracer):
+                result = JOB_KINDS[kind](params, work_dir, report)
+            result['timings'] = tracer.summary()
+            events.put(("done", job_id, result))
+        except Exception as e:
+            traceback.print_exc()
+            events.put(("failed", job_id, f"{type(e).__name__}: {e}"))
+
+class _Worker:
+    def __init__(self, ctx, pool, events, warm_up):
+        self.pool = pool
+        self.job_id = None
+        self.inbox = ctx.Queue()
+        self.process = ctx.Process(target=_worker_loop, args=(pool, self.inbox, events, warm_up),
+                                   name=f"genlyrics-{pool}", daemon=True)
+        self.process.start()
+
+    def stop(self, timeout=5):
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+class JobQueue:
+    """
+    Local job queue backed by long-lived worker processes.
+    Each pool (sized by limits) is started on demand, so heavy models stay
+    loaded between jobs and one kind cannot starve another. Alignment jobs
+    share the import pool and its loaded model, ahead of queued imports. Every job gets its own working directory under root.
+    submit() returns a job id; get() returns the job with its latest
+    progress; cancel() drops a queued job or stops a running one.
+    warm_up: Whisper model size the import workers load at start.
+    """
+
+    def __init__(self, root=JOBS_DIR, limits=None, warm_up=None):
+        self.root = root
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.warm_up = warm_up
+        self.jobs = {}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._events = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._pending = {pool: deque() for pool in self.limits}
+        self._workers = {pool: [] for pool in self.limits}
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, name="job-queue", daemon=True)
+        self._collector.start()
+
+    def submit(self, kind, params, work_dir=None):
+        """
+        Queues a job and returns its id. params must be picklable; they are
+        copied, so later changes by the caller don't leak into the job.
+        """
+        if kind not in JOB_KINDS or _pool(kind) not in self.limits:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(kind, copy.deepcopy(params), None)
+        job.work_dir = work_dir or os.path.join(self.root, job.id)
+        os.makedirs(job.work_dir, exist_ok=True)
+        with self._lock:
+            self.jobs[job.id] = job
+            if kind in URGENT_KINDS:
+                self._pending[_pool(kind)].appendleft(job)
+            else:
+                self._pending[_pool(kind)].append(job)
+            self._dispatch()
+        return job.id
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def position(self, job_id):
+        """
+        How many jobs of the same pool are ahead of a queued job.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                return 0
+            return list(self._pending[_pool(job.kind)]).index(job)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Returns False if it already ended.
+        A running job of UNINTERRUPTIBLE_KINDS keeps its worker: it runs to
+        the end and is then marked cancelled, without a result.
+        """
+        worker = None
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            if job.state == QUEUED:
+                self._pending[_pool(job.kind)].remove(job)
+            elif job.kind in UNINTERRUPTIBLE_KINDS:
+                job.cancel_requested = True
+                return True
+            else:
+                workers = self._workers[_pool(job.kind)]
+                worker = next(w for w in workers if w.job_id == job_id)
+                workers.remove(worker)
+            job.state = CANCELLED
+            job.finished = time.time()
+            self._dispatch()
+        # Stopping can take seconds; polling and new submissions shouldn't wait for it
+        if worker is not None:
+            worker.stop()
+        return True
+
+    def discard(self, job_id):
+        """
+        Forgets a finished job and deletes its working directory.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.active:
+                return
+            del self.jobs[job_id]
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for job in self.jobs.values():
+                if job.active:
+                    job.state = CANCELLED
+            stopping = [worker for workers in self._workers.values() for worker in workers]
+            for workers in self._workers.values():
+                workers.clear()
+        for worker in stopping:
+            worker.stop()
+
+    def _dispatch(self):
+        # Caller holds the lock
+        if self._closed:
+            return
+        for pool, pending in self._pending.items():
+            workers = self._workers[pool]
+            while pending:
+                worker = next((w for w in workers if w.job_id is None), None)
+                if worker is None:
+                    if len(workers) >= self.limits[pool]:
+                        break
+                    worker = _Worker(self._ctx, pool, self._events,
+                                     self.warm_up if pool == "import" else None)
+                    workers.append(worker)
+                job = pending.popleft()
+                job.state = RUNNING
+                job.started = time.time()
+                worker.job_id = job.id
+                worker.inbox.put((job.id, job.kind, job.params, job.work_dir))
+
+    def _collect(self):
+        while not self._closed:
+            try:
+                event, job_id, payload = self._events.get(timeout=1)
+            except queue.Empty:
+                self._reap()
+                continue
+            with self._lock:
+                job = self.jobs.get(job_id)
+                # Late events from a cancelled job are dropped
+                if job is None or job.state != RUNNING:
+                    continue
+                if event == "progress":
+                    job.stage = payload['stage']
+                    job.progress = payload['progress']
+                    job.message = payload['message']
+                    continue
+                if job.cancel_requested:
+                    job.state = CANCELLED
+                elif event == "done":
+                    job.state, job.result, job.progress = DONE, payload, 1.0
+                else:
+                    job.state, job.error = FAILED, payload
+                job.finished = time.time()
+                for worker in self._workers[_pool(job.kind)]:
+                    if worker.job_id == job_id:
+                        worker.job_id = None
+                self._dispatch()
+
+    def _reap(self):
+        """
+        Fails the job of any worker that died (crash, OOM kill) and lets a
+        new worker take its place.
+        """
+        with self._lock:
+            for workers in self._workers.values():
+                for worker in [w for w in workers if not w.process.is_alive()]:
+                    workers.remove(worker)
+                    job = self.jobs.get(worker.job_id)
+                    if job is not None and job.state == RUNNING:
+                        job.state = FAILED
+                        job.error = f"Worker exited with code {worker.process.exitcode}"
+                        job.finished = time.time()
+            self._dispatch()
@@ -1,33 +1,478 @@
-import whisper
 import warnings
+import threading
+import multiprocessing
+import weakref
+from tracing import span, traced
+from audio_io import (load_audio, register_audio, release_audio, stream_audio, AudioBuffer, WavWriter,
+                      WHISPER_SAMPLE_RATE)
 
 # Suppress FP16 warning on CPU
 warnings.filterwarnings("ignore")
 
-def transcribe_with_lyrics(audio_path, model_size="small"):
+# Loaded Whisper models, keyed by (model_size, device, dtype)
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+# One lock per model key, held while that model loads, so a slow load
+# doesn't hold up lookups of models that are already there
+_LOAD_LOCKS = {}
+# One inference at a time per model: Whisper installs hooks on the model
+# while it decodes and aligns, so concurrent calls would read each other's
+# kv-cache and attention weights
+_INFERENCE_LOCKS = weakref.WeakKeyDictionary()
+_INFERENCE_LOCKS_LOCK = threading.Lock()
+
+# Window and overlap (seconds) of the streaming separation and transcription
+SEPARATE_WINDOW, SEPARATE_OVERLAP = 60.0, 5.0
+TRANSCRIBE_WINDOW, TRANSCRIBE_OVERLAP = 300.0, 20.0
+# Characters of the text so far passed to the next window as its prompt
+PROMPT_CHARS = 200
+# Longest silence (seconds) kept inside one voiced chunk
+VAD_MAX_GAP = 1.5
+
+def _resolve_device(device=None, dtype=None):
+    import torch
+
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if dtype is None:
+        # Whisper only runs in half precision on GPU
+        dtype = "float16" if device.startswith("cuda") else "float32"
+    return device, dtype
+
+def _load_lock(key):
+    with _MODELS_LOCK:
+        return _LOAD_LOCKS.setdefault(key, threading.Lock())
+
+def get_model(model_size="small", device=None, dtype=None):
+    """
+    Returns a Whisper model, loading it only the first time it is asked for
+    in this process. Later calls with the same size/device/dtype reuse it.
+    """
+    key = (model_size,) + _resolve_device(device, dtype)
+
+    with _load_lock(("whisper",) + key):
+        if key not in _MODELS:
+            # Imported on first use: whisper pulls in torch, which is slow to load
+            import whisper
+            print(f"Loading Whisper ({model_size}) on {key[1]}...")
+            with span("model_load", model=model_size):
+                _MODELS[key] = whisper.load_model(model_size, device=key[1])
+        return _MODELS[key]
+
+def inference_lock(model):
+    """
+    The lock every transcription or alignment on model must hold.
+    """
+    with _INFERENCE_LOCKS_LOCK:
+        return _INFERENCE_LOCKS.setdefault(model, threading.Lock())
+
+def warm_up(model_size="medium", device=None, dtype=None):
+    """
+    Loads a model ahead of the first transcription so the first song
+    does not pay for it.
+    """
+    get_model(model_size, device, dtype)
+
+@traced("transcribe_with_lyrics")
+def transcribe_with_lyrics(audio_path, model_size="small", device=None, dtype=None, model=None):
     """
     Transcribes audio and returns segments with WORD-level timestamps.
+    audio_path may also be 16 kHz mono float32 samples already in memory.
+    Uses the shared model for model_size unless a loaded model is passed in.
     """
-    print(f"Transcribing {audio_path} using Whisper ({model_size})...")
-    
-    model = whisper.load_model(model_size)
-    
+    source = audio_path if isinstance(audio_path, str) else "in-memory audio"
+    print(f"Transcribing {source} using Whisper ({model_size})...")
+
+    device, dtype = _resolve_device(device, dtype)
+    if model is None:
+        model = get_model(model_size, device, dtype)
+
     # word_timestamps=True is crucial here
-    result = model.transcribe(audio_path, word_timestamps=True)
-    
+    with inference_lock(model):
+        result = model.transcribe(audio_path, word_timestamps=True, fp16=(dtype == "float16"))
+
+    # Kept on each segment so a later forced alignment uses the same language
+    for seg in result['segments']:
+        seg['language'] = result.get('language')
     return result['segments']
 
-def isolate_vocals(audio_path, output_dir="./temp/separated"):
+def transcribe_windows(audio_path, model_size="small", device=None, dtype=None, model=None,
+                       window=TRANSCRIBE_WINDOW, overlap=TRANSCRIBE_OVERLAP):
+    """
+    Transcribes a file window by window and yields its segments in order,
+    with timestamps on the file's timeline, as each window finishes. At
+    most two windows of 16 kHz audio are held, however long the file.
+    A segment is kept from the window where it starts on that window's
+    side of the middle of the overlap, so a line cut by a window edge
+    comes from the window that heard it whole; a segment starting before
+    the previous kept one ended is dropped. The end of the text so far
+    is the next window's prompt.
+    """
+    device, dtype = _resolve_device(device, dtype)
+    if model is None:
+        model = get_model(model_size, device, dtype)
+    print(f"Transcribing {audio_path} in {window:.0f}s windows using Whisper ({model_size})...")
+
+    windows = stream_audio(audio_path, window, overlap, WHISPER_SAMPLE_RATE, channels=1)
+    current = next(windows, None)
+    n_segments = 0
+    last_end = float('-inf')
+    prompt = ""
+    while current is not None:
+        # One window of lookahead tells whether this one is the last
+        upcoming = next(windows, None)
+        start, samples = current
+        own_start = start + overlap / 2 if start > 0 else float('-inf')
+        own_end = start + window - overlap / 2 if upcoming is not None else float('inf')
+
+        with span("transcribe_window", start=start), inference_lock(model):
+            result = model.transcribe(samples[:, 0], word_timestamps=True, fp16=(dtype == "float16"),
+                                      initial_prompt=prompt or None)
+        for seg in result['segments']:
+            seg = _shift_segment(seg, start)
+            seg['language'] = result.get('language')
+            if not own_start <= seg['start'] < own_end or seg['start'] < last_end:
+                continue
+            seg['id'] = n_segments
+            n_segments += 1
+            last_end = seg['end']
+            prompt = (prompt + seg['text'])[-PROMPT_CHARS:]
+            yield seg
+        current = upcoming
+
+def detect_voiced_regions(audio, sample_rate=WHISPER_SAMPLE_RATE, frame_ms=30,
+                          threshold_db=-40.0, min_silence=1.0, padding=0.2):
+    """
+    Energy-based voice activity detection on an isolated vocals stem.
+    A frame is voiced when its RMS is within threshold_db of the loudest
+    frame. Gaps shorter than min_silence seconds are bridged and every
+    region is padded by `padding` seconds.
+    Returns a list of (start_sample, end_sample).
+    """
+    import numpy as np
+
+    frame_len = int(sample_rate * frame_ms / 1000)
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    frames = np.asarray(audio[:n_frames * frame_len], dtype=np.float32).reshape(n_frames, frame_len)
+    rms_db = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    voiced = rms_db > rms_db.max() + threshold_db
+
+    # Edges of voiced runs
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    regions = []
+    min_gap = min_silence * 1000 / frame_ms
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    pad = int(padding * sample_rate)
+    return [(int(max(0, start * frame_len - pad)), int(min(len(audio), end * frame_len + pad)))
+            for start, end in regions]
+
+def plan_voiced_chunks(regions, sample_rate=WHISPER_SAMPLE_RATE, max_chunk=60.0, max_gap=VAD_MAX_GAP):
+    """
+    Groups neighbouring voiced regions into chunks of at most max_chunk
+    seconds. Regions are only merged across gaps of up to max_gap seconds,
+    so long silences stay out of the chunks Whisper sees. A single region
+    longer than max_chunk stays one chunk.
+    """
+    chunks = []
+    limit = int(max_chunk * sample_rate)
+    gap = int(max_gap * sample_rate)
+    for start, end in regions:
+        if chunks and start - chunks[-1][1] <= gap and end - chunks[-1][0] <= limit:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+def _shift_segment(seg, offset):
+    seg = dict(seg)
+    seg['start'] += offset
+    seg['end'] += offset
+    if 'seek' in seg:
+        # seek is counted in 10 ms mel frames
+        seg['seek'] += int(round(offset * 100))
+    if 'words' in seg:
+        seg['words'] = [dict(w, start=w['start'] + offset, end=w['end'] + offset)
+                        for w in seg['words']]
+    return seg
+
+# CPU pools for transcribe_chunked, keyed by (model_size, workers). They
+# live as long as the process, so each worker loads its model only once
+_CHUNK_POOLS = {}
+
+def _chunk_pool(model_size, workers):
+    from concurrent.futures import ProcessPoolExecutor
+
+    key = (model_size, workers)
+    with _MODELS_LOCK:
+        if key not in _CHUNK_POOLS:
+            ctx = multiprocessing.get_context("spawn")
+            _CHUNK_POOLS[key] = ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                                    initializer=warm_up,
+                                                    initargs=(model_size, "cpu", "float32"))
+        return _CHUNK_POOLS[key]
+
+def _transcribe_chunk(job):
+    # Runs in a pool worker; the model is loaded once per worker process, at start
+    audio, offset, model_size = job
+    model = get_model(model_size, device="cpu", dtype="float32")
+    result = model.transcribe(audio, word_timestamps=True, fp16=False)
+    return [dict(_shift_segment(seg, offset), language=result.get('language')) for seg in result['segments']]
+
+@traced("transcribe_chunked")
+def transcribe_chunked(audio_path, model_size="small", workers=2, max_chunk=60.0, max_gap=VAD_MAX_GAP,
+                       **vad_options):
+    """
+    Transcribes only the voiced parts of a vocals stem.
+    The stem is split at silent gaps, silent stretches are dropped, and the
+    voiced chunks are transcribed in parallel on CPU worker processes (each
+    holds its own model, kept loaded for later calls). Returns one segments list with timestamps (and
+    word timestamps) on the original timeline.
+    audio_path may also be 16 kHz mono float32 samples already in memory.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    if isinstance(audio_path, str):
+        import whisper
+        print(f"Transcribing {audio_path} in voiced chunks using Whisper ({model_size})...")
+        audio = whisper.load_audio(audio_path)
+    else:
+        print(f"Transcribing in voiced chunks using Whisper ({model_size})...")
+        audio = audio_path
+    regions = detect_voiced_regions(audio, **vad_options)
+    chunks = plan_voiced_chunks(regions, max_chunk=max_chunk, max_gap=max_gap)
+    voiced = sum(end - start for start, end in chunks) / WHISPER_SAMPLE_RATE
+    print(f"{len(chunks)} voiced chunks, {voiced:.0f}s of {len(audio) / WHISPER_SAMPLE_RATE:.0f}s")
+
+    jobs = [(audio[start:end], start / WHISPER_SAMPLE_RATE, model_size) for start, end in chunks]
+    try:
+        results = list(_chunk_pool(model_size, workers).map(_transcribe_chunk, jobs))
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); the next call starts a new pool
+        with _MODELS_LOCK:
+            _CHUNK_POOLS.pop((model_size, workers), None)
+        raise
+
+    segments = []
+    for chunk_segments in results:
+        for seg in chunk_segments:
+            seg['id'] = len(segments)
+            segments.append(seg)
+    return segments
+
+def _group_words(alignment):
+    """
+    Folds Whisper's word timings into whitespace-separated words
+    (e.g. "rock", "-n", "-roll" -> "rock-n-roll").
+    """
+    groups = []
+    for timing in alignment:
+        if not timing.word:
+            continue
+        if timing.word.startswith(" ") or not groups:
+            groups.append([timing.start, timing.end, [timing.probability]])
+        else:
+            groups[-1][1] = timing.end
+            groups[-1][2].append(timing.probability)
+    return groups
+
+@traced("align_words")
+def align_words(text, audio, start, end, model_size="small", model=None, language=None, padding=0.25):
+    """
+    Forced alignment of known text against audio[start - padding : end + padding].
+    Only that slice is run through the model (one forward pass, no decoding),
+    so correcting a line takes a fraction of a second on a loaded model.
+    audio: the whole track as 16 kHz mono samples, or a path to it.
+    Returns one word dict per whitespace-separated word of text, with
+    start/end on the track's timeline. language: the transcript's language
+    (segments carry it), English if unknown.
+    Raises ValueError if the slice is longer than Whisper's 30 s window or
+    the alignment does not line up with the words.
+    """
+    import numpy as np
+    import torch
+    from whisper.audio import N_FRAMES, HOP_LENGTH, log_mel_spectrogram, pad_or_trim
+    from whisper.timing import find_alignment, merge_punctuations
+    from whisper.tokenizer import get_tokenizer
+
+    words = text.split()
+    if not words:
+        return []
+    if isinstance(audio, str):
+        audio = load_audio(audio).whisper_audio()
+    if model is None:
+        model = get_model(model_size)
+
+    offset = max(0.0, start - padding)
+    lo = int(offset * WHISPER_SAMPLE_RATE)
+    hi = min(len(audio), int((end + padding) * WHISPER_SAMPLE_RATE))
+    num_frames = (hi - lo) // HOP_LENGTH
+    if num_frames <= 0:
+        raise ValueError("Line is outside the audio")
+    if num_frames > N_FRAMES:
+        raise ValueError("Line is longer than Whisper's 30 s window")
+
+    dtype = torch.float16 if model.device.type == "cuda" else torch.float32
+    mel = log_mel_spectrogram(torch.from_numpy(np.ascontiguousarray(audio[lo:hi])), model.dims.n_mels)
+    mel = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
+
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                              language=language or "en", task="transcribe")
+    text_tokens = tokenizer.encode(" " + " ".join(words))
+    with inference_lock(model):
+        alignment = find_alignment(model, tokenizer, text_tokens, mel, num_frames)
+    # Same punctuation handling as transcribe(word_timestamps=True)
+    merge_punctuations(alignment, "\"'“¿([{-", "\"'.。,，!！?？:：”)]}、")
+
+    groups = _group_words(alignment)
+    if len(groups) != len(words):
+        raise ValueError(f"Aligned {len(groups)} words, expected {len(words)}")
+    return [{'word': ' ' + word,
+             'start': round(offset + float(w_start), 3),
+             'end': round(offset + float(w_end), 3),
+             'probability': round(float(np.mean(probs)), 3)}
+            for word, (w_start, w_end, probs) in zip(words, groups)]
+
+# Loaded Demucs separators, keyed by (model_name, device, options)
+_SEPARATORS = {}
+
+class VocalSeparator:
     """
-    Uses demucs (installed in venv-demucs-sys) to separate vocals.
-    Returns path to vocals.wav.
+    Keeps a Demucs model loaded and separates vocals from in-memory audio.
+    Only the vocals stem is produced; nothing is written to disk unless
+    separate_file is used.
+    segment: seconds per split (None = model default), overlap: fraction
+    shared between splits, threads: torch CPU threads (None = torch default).
+    """
+
+    def __init__(self, model_name="htdemucs", device=None, segment=None, overlap=0.25, threads=None):
+        import torch
+        from demucs.pretrained import get_model as get_demucs_model
+
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.segment = segment
+        self.overlap = overlap
+        self.threads = threads
+
+        print(f"Loading Demucs ({model_name}) on {self.device}...")
+        with span("model_load", model=model_name):
+            self.model = get_demucs_model(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.sample_rate = self.model.samplerate
+        self.channels = self.model.audio_channels
+        self._vocals_idx = self.model.sources.index("vocals")
+        self._lock = threading.Lock()
+
+    def separate(self, wav, sample_rate):
+        """
+        wav: float array shaped (channels, samples) or (samples,).
+        Returns the vocals as float32 (channels, samples) at self.sample_rate.
+        """
+        import numpy as np
+        import torch
+        import julius
+        from demucs.apply import apply_model
+
+        mix = torch.as_tensor(np.asarray(wav, dtype=np.float32))
+        if mix.dim() == 1:
+            mix = mix[None]
+        # Match the model's channel count and rate
+        if mix.shape[0] != self.channels:
+            mix = mix.mean(0, keepdim=True).expand(self.channels, -1)
+        if sample_rate != self.sample_rate:
+            mix = julius.resample_frac(mix, sample_rate, self.sample_rate)
+
+        # Same normalization as the demucs CLI; the epsilon (as in demucs'
+        # API) keeps a silent window, common when streaming, from turning into NaN
+        ref = mix.mean(0)
+        mix = (mix - ref.mean()) / (ref.std() + 1e-8)
+
+        with self._lock, torch.no_grad():
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            sources = apply_model(self.model, mix[None].to(self.device), device=self.device,
+                                  segment=self.segment, overlap=self.overlap,
+                                  split=True, progress=False)[0]
+
+        vocals = sources[self._vocals_idx].cpu() * ref.std() + ref.mean()
+        return vocals.numpy()
+
+    def separate_file(self, audio_path, vocals_path):
+        """
+        Separates audio_path, writes only the vocals stem to vocals_path.
+        The source comes from the shared decoded buffer and the vocals stay
+        registered in memory, so transcription does not read them back.
+        """
+        import torch
+        from demucs.audio import save_audio
+
+        mix = load_audio(audio_path)
+        vocals = self.separate(mix.planar, mix.sample_rate)
+        save_audio(torch.from_numpy(vocals), vocals_path, samplerate=self.sample_rate)
+        register_audio(vocals_path, AudioBuffer(vocals.T, self.sample_rate))
+        # Nothing else needs the decoded mix; the renderer muxes the original file
+        release_audio(audio_path)
+        return vocals_path
+
+    def separate_stream(self, audio_path, vocals_path, window=SEPARATE_WINDOW, overlap=SEPARATE_OVERLAP):
+        """
+        Separates audio_path window by window and appends the vocals to
+        vocals_path as they come, so memory stays the same for any length.
+        Each window is normalized on its own (the CLI uses whole-track
+        statistics) and neighbouring windows are cross-faded over the
+        overlap. The vocals are not kept in memory.
+        """
+        import numpy as np
+
+        fade_len = int(overlap * self.sample_rate)
+        fade_in = np.linspace(0, 1, fade_len, dtype=np.float32)[:, None]
+        # End of the previous window, still to be faded into the next one
+        tail = None
+        with WavWriter(vocals_path, self.sample_rate, self.channels) as out:
+            for start, mix in stream_audio(audio_path, window, overlap, self.sample_rate, self.channels):
+                if not len(mix):
+                    continue
+                with span("separate_window", start=start):
+                    vocals = self.separate(mix.T, self.sample_rate).T
+                if tail is not None:
+                    vocals[:fade_len] = tail * (1 - fade_in) + vocals[:fade_len] * fade_in
+                out.write(vocals[:len(vocals) - fade_len])
+                tail = vocals[len(vocals) - fade_len:]
+            if tail is not None:
+                out.write(tail)
+        return vocals_path
+
+def get_separator(model_name="htdemucs", device=None, **options):
+    """
+    Returns a VocalSeparator, loading the model only the first time it is
+    asked for in this process. Each set of options gets its own instance,
+    so callers with different settings never change each other's runs.
+    """
+    key = (model_name, device, tuple(sorted(options.items())))
+    with _load_lock(("demucs",) + key):
+        if key not in _SEPARATORS:
+            _SEPARATORS[key] = VocalSeparator(model_name, device, **options)
+        return _SEPARATORS[key]
+
+def _isolate_vocals_cli(audio_path, output_dir):
+    """
+    Legacy path: runs demucs from the separate venv-demucs-sys environment.
     """
     import subprocess
-    import glob
     import os
-    
-    print(f"Isolating vocals for {audio_path}...")
-    
+
     # Path to the python executable in the venv we created
     demucs_python = "./venv-demucs-sys/bin/python3"
     
@@ -54,3 +499,32 @@ def isolate_vocals(audio_path, output_dir="./temp/separated"):
         print(f"Demucs failed: {e}. Using original audio.")
         return audio_path
 
+@traced("isolate_vocals")
+def isolate_vocals(audio_path, output_dir="./temp/separated", segment=None, overlap=0.25, threads=None,
+                   stream=False):
+    """
+    Separates vocals with a Demucs model kept loaded in this process.
+    Returns path to vocals.wav (output_dir/htdemucs/song_name/vocals.wav).
+    stream=True separates in SEPARATE_WINDOW windows with bounded memory.
+    Falls back to the venv-demucs-sys CLI when demucs is not installed here
+    (the CLI always loads the whole file).
+    """
+    import os
+    
+    print(f"Isolating vocals for {audio_path}...")
+    
+    try:
+        separator = get_separator("htdemucs", segment=segment, overlap=overlap, threads=threads)
+    except ImportError:
+        print("Demucs not available in this environment, using venv-demucs-sys.")
+        return _isolate_vocals_cli(audio_path, output_dir)
+    
+    song_name = os.path.splitext(os.path.basename(audio_path))[0]
+    song_dir = os.path.join(output_dir, "htdemucs", song_name)
+    os.makedirs(song_dir, exist_ok=True)
+    if stream:
+        vocals_path = separator.separate_stream(audio_path, os.path.join(song_dir, "vocals.wav"))
+    else:
+        vocals_path = separator.separate_file(audio_path, os.path.join(song_dir, "vocals.wav"))
+    print(f"Vocals isolated: {vocals_path}")
+    return vocals_path
@@ -1,34 +1,116 @@
 import argparse
 import os
-from audio_fetcher import download_audio
-from lyrics_engine import transcribe_with_lyrics
-from renderer import create_lyrics_video
+from artifact_cache import ArtifactCache, CACHE_DIR
+from pipeline import fetch_audio, separate_vocals, transcribe, transcribe_stream
+from renderer import create_lyrics_video, create_format_videos, create_stream_video
+from tracing import Tracer, use_tracer, profiled
 
 def main():
     parser = argparse.ArgumentParser(description="YouTube Lyrics Video Generator")
-    parser.add_argument("url", type=str, help="YouTube URL")
+    parser.add_argument("url", type=str, nargs="?", help="YouTube URL")
     parser.add_argument("--output", type=str, default="lyrics_video.mp4", help="Output filename")
+    parser.add_argument("--workers", type=int, default=1, help="Render processes (default: 1)")
+    parser.add_argument("--karaoke-wipe", action="store_true", help="Fill each word from left to right while it is sung")
+    parser.add_argument("--backend", choices=["frames", "ass"], default="frames",
+                        help="frames: Python frame loop; ass: ASS karaoke burned in by ffmpeg/libass (faster)")
+    parser.add_argument("--formats", type=str,
+                        help="Comma-separated output formats rendered in one pass (landscape, shorts, square)")
+    parser.add_argument("--subtitles", action="store_true", help="Also write .srt/.ass/.lrc next to the video")
+    parser.add_argument("--stream", action="store_true",
+                        help="Bounded memory for long tracks: separate and transcribe in windows and render as lines come in")
+    parser.add_argument("--model", type=str, default="medium", help="Whisper model size (default: medium)")
+    parser.add_argument("--vad-workers", type=int, default=0, help="Transcribe voiced chunks on N CPU processes (default: off)")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Where downloads, stems and transcripts are cached")
+    parser.add_argument("--no-cache", action="store_true", help="Always re-run download, separation and transcription")
+    
+    parser.add_argument("--trace", type=str, help="Write a Chrome trace (JSON) of the run here")
+    parser.add_argument("--profile", type=str, help="Write cProfile stats here (batch: per job, into the traces folder)")
+    
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--batch", type=str, help="Playlist URL or text file of URLs/audio paths (one per line)")
+    batch.add_argument("--output-dir", type=str, default="./output", help="Where batch videos and the report go")
+    batch.add_argument("--download-workers", type=int, default=2, help="Concurrent downloads")
+    batch.add_argument("--ml-workers", type=int, default=1, help="Concurrent separation/transcription jobs")
+    batch.add_argument("--render-workers", type=int, default=1, help="Concurrent renders")
+    batch.add_argument("--queue-size", type=int, default=2, help="Jobs allowed to wait between stages")
+    batch.add_argument("--no-trace", action="store_true", help="Don't write per-job traces")
     
     args = parser.parse_args()
+    if not args.url and not args.batch:
+        parser.error("give a URL or --batch")
+    if args.formats and (args.backend != "frames" or args.workers != 1):
+        parser.error("--formats renders with the frames backend in one process; drop --backend and --workers")
+    if args.stream and (args.formats or args.backend != "frames" or args.workers != 1 or args.vad_workers):
+        parser.error("--stream renders with the frames backend in one process as lines are transcribed; "
+                     "drop --formats, --backend, --workers and --vad-workers")
+    if args.batch and (args.formats or args.stream or args.trace):
+        parser.error("--batch renders one video per song and traces each job into OUTPUT_DIR/traces; "
+                     "drop --formats, --stream and --trace")
+    
+    cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+    
+    if args.batch:
+        from batch import expand_sources, run_batch
+        sources = expand_sources(args.batch)
+        print(f"--- Batch: {len(sources)} songs ---")
+        run_batch(sources, output_dir=args.output_dir, cache=cache,
+                  download_workers=args.download_workers, ml_workers=args.ml_workers,
+                  render_workers=args.render_workers, render_processes=args.workers,
+                  queue_size=args.queue_size, model_size=args.model, vad_workers=args.vad_workers,
+                  karaoke_wipe=args.karaoke_wipe, backend=args.backend, sidecars=args.subtitles,
+                  trace=not args.no_trace, profile=bool(args.profile))
+        return
+    
+    tracer = Tracer(args.url)
+    with use_tracer(tracer), profiled(args.profile):
+        run_single(args, cache)
     
+    if args.trace:
+        tracer.export_chrome(args.trace)
+        print(f"Trace: {args.trace}")
+    for name, seconds in tracer.summary()['spans'].items():
+        print(f"  {name:<24} {seconds:8.2f}s")
+
+def run_single(args, cache):
     # 1. Download
     print(f"--- 1. Downloading... ---")
-    audio_path, title = download_audio(args.url)
+    audio_path, title = fetch_audio(args.url, cache)
     print(f"Title: {title}")
     
+    if args.stream:
+        run_stream(args, audio_path, cache)
+        return
+
     # 2. Transcribe
     print(f"--- 2. Transcribing... ---")
     
     # Isolate vocals first!
-    from lyrics_engine import isolate_vocals
-    vocals_path = isolate_vocals(audio_path)
+    vocals_path = separate_vocals(audio_path, cache)
     
     # Transcribe the vocals, but keep original audio for the video
-    segments = transcribe_with_lyrics(vocals_path, model_size="medium")
+    segments = transcribe(vocals_path, cache, model_size=args.model, vad_workers=args.vad_workers)
     
     # 3. Render
     print(f"--- 3. Animating... ---")
-    create_lyrics_video(audio_path, segments, output_path=args.output)
+    if args.formats:
+        stem = os.path.splitext(args.output)[0]
+        outputs = [(f"{stem}_{name}.mp4", name) for name in args.formats.split(",")]
+        create_format_videos(audio_path, segments, outputs, karaoke_wipe=args.karaoke_wipe,
+                             sidecars=args.subtitles)
+        return
+    create_lyrics_video(audio_path, segments, output_path=args.output, workers=args.workers,
+                        karaoke_wipe=args.karaoke_wipe, backend=args.backend, sidecars=args.subtitles)
+
+def run_stream(args, audio_path, cache):
+    # Memory stays flat with the track length: every stage works on windows
+    # and the renderer encodes each line as soon as it is transcribed
+    print(f"--- 2. Separating vocals (streaming)... ---")
+    vocals_path = separate_vocals(audio_path, cache, stream=True)
+
+    print(f"--- 3. Transcribing and animating... ---")
+    segments = transcribe_stream(vocals_path, cache, model_size=args.model)
+    create_stream_video(audio_path, segments, output_path=args.output, karaoke_wipe=args.karaoke_wipe,
+                        sidecars=args.subtitles)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import tempfile
+from audio_fetcher import download_audio, get_video_info
+from lyrics_engine import (isolate_vocals, transcribe_with_lyrics, transcribe_chunked, transcribe_windows,
+                           SEPARATE_WINDOW, SEPARATE_OVERLAP, TRANSCRIBE_WINDOW, TRANSCRIBE_OVERLAP, VAD_MAX_GAP)
+from artifact_cache import file_hash
+from audio_io import loaded_audio, alias_audio, release_audio
+
+# Stage parameters that go into the cache keys
+DEMUCS_MODEL = "htdemucs"
+# segment_language: segments carry the detected language (older transcripts do not)
+TRANSCRIBE_OPTIONS = {"word_timestamps": True, "segment_language": True}
+
+def fetch_audio(url, cache=None, use_cookies=False):
+    """
+    Downloads the audio for a URL. Cached by video id.
+    Returns (audio_path, title).
+    """
+    if cache is None:
+        return download_audio(url, use_cookies=use_cookies)
+
+    info = get_video_info(url, use_cookies=use_cookies)
+    key = cache.key("download", video_id=info['id'], extractor=info.get('extractor_key'), codec="source")
+    cached = cache.get_file(key)
+    if cached:
+        print(f"Using cached download for {info['id']}")
+        return cached, cache.meta(key).get('title', info.get('title', 'Unknown Song'))
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_dl_")
+    try:
+        audio_path, title = download_audio(url, output_dir=work_dir, use_cookies=use_cookies)
+        return cache.put_file(key, audio_path, stage="download", meta={'title': title}, move=True), title
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def separate_vocals(audio_path, cache=None, stream=False):
+    """
+    Isolates the vocals stem. Cached by audio content + Demucs model.
+    stream=True separates in windows with bounded memory (cached apart from
+    whole-track stems, since the result differs slightly).
+    """
+    if cache is None:
+        return isolate_vocals(audio_path, stream=stream)
+
+    params = {'audio': file_hash(audio_path), 'model': DEMUCS_MODEL}
+    if stream:
+        params['stream'] = [SEPARATE_WINDOW, SEPARATE_OVERLAP]
+    key = cache.key("separate", **params)
+    cached = cache.get_file(key)
+    if cached:
+        print("Using cached vocals")
+        return cached
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_sep_")
+    try:
+        vocals_path = isolate_vocals(audio_path, output_dir=work_dir, stream=stream)
+        if vocals_path == audio_path:
+            # Separation failed and fell back to the original; don't remember that
+            return audio_path
+        cached_path = cache.put_file(key, vocals_path, stage="separate", move=True)
+        # Keep the in-memory vocals reachable under their new path
+        alias_audio(vocals_path, cached_path)
+        return cached_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _run_transcription(vocals_path, model_size, model, vad_workers):
+    # Vocals separated in this process are still in memory: hand Whisper
+    # the samples instead of having it decode the file again
+    buffer = loaded_audio(vocals_path)
+    try:
+        audio = buffer.whisper_audio() if buffer is not None else vocals_path
+        if vad_workers:
+            return transcribe_chunked(audio, model_size=model_size, workers=vad_workers)
+        return transcribe_with_lyrics(audio, model_size=model_size, model=model)
+    finally:
+        # Nothing after transcription needs the decoded stem; long-lived
+        # workers would otherwise keep the last few songs' vocals resident
+        release_audio(vocals_path)
+
+def transcribe(vocals_path, cache=None, model_size="medium", model=None, vad_workers=0):
+    """
+    Word-level transcription. Cached by vocals content + model size + options.
+    Runs on the given model if one is passed.
+    vad_workers > 0 transcribes only voiced chunks on that many CPU processes.
+    """
+    if cache is None:
+        return _run_transcription(vocals_path, model_size, model, vad_workers)
+
+    # The chunking settings are part of the key: they change what Whisper hears
+    options = dict(TRANSCRIBE_OPTIONS, vad={'max_gap': VAD_MAX_GAP} if vad_workers else False)
+    key = cache.key("transcribe", audio=file_hash(vocals_path), model=model_size,
+                    options=options)
+    segments = cache.get_json(key)
+    if segments is not None:
+        print("Using cached transcription")
+        release_audio(vocals_path)
+        return segments
+
+    segments = _run_transcription(vocals_path, model_size, model, vad_workers)
+    cache.put_json(key, segments, stage="transcribe")
+    return segments
+
+def transcribe_stream(vocals_path, cache=None, model_size="medium", model=None):
+    """
+    Streaming transcription: yields segments as each window is transcribed,
+    with bounded memory. With a cache they are written to a JSON-lines file
+    on the way and the file is cached once the stream completes; a cached
+    transcript is read back line by line.
+    """
+    if cache is None:
+        yield from transcribe_windows(vocals_path, model_size=model_size, model=model)
+        return
+
+    options = dict(TRANSCRIBE_OPTIONS, stream=[TRANSCRIBE_WINDOW, TRANSCRIBE_OVERLAP])
+    key = cache.key("transcribe", audio=file_hash(vocals_path), model=model_size, options=options)
+    cached = cache.get_file(key)
+    if cached:
+        print("Using cached transcription")
+        with open(cached) as f:
+            for line in f:
+                yield json.loads(line)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_tr_")
+    try:
+        segments_path = os.path.join(work_dir, "segments.jsonl")
+        with open(segments_path, "w") as f:
+            for seg in transcribe_windows(vocals_path, model_size=model_size, model=model):
+                f.write(json.dumps(seg) + "\n")
+                yield seg
+        cache.put_file(key, segments_path, stage="transcribe", move=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,8 +1,24 @@
-import cv2
 import numpy as np
 import subprocess
 import os
-from PIL import Image, ImageDraw, ImageFont
+import json
+import threading
+import shutil
+import hashlib
+import time
+import tempfile
+import contextlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from video_encoder import FFmpegWriter
+from audio_io import mux_audio_args
+from artifact_cache import file_hash
+from font_manager import load_font
+from subtitles import write_ass, export_subtitles
+from tracing import span, count, traced
+from timeline import TimingIndex, WORD_ACTIVE, WORD_INACTIVE, WORD_SUNG, WORD_WIPE, WIPE_LEVELS
 
 def wrap_text_pil(text, font, max_width):
     """
@@ -11,172 +27,1216 @@ def wrap_text_pil(text, font, max_width):
     lines = []
     if not text:
         return lines
-        
+
     words = text.split(' ')
     current_line = []
-    
+
     for word in words:
         current_line.append(word)
         # Check width
         test_line = ' '.join(current_line)
         bbox = font.getbbox(test_line) # left, top, right, bottom
         w = bbox[2] - bbox[0]
-        
+
         if w > max_width and len(current_line) > 1:
             current_line.pop()
             lines.append(' '.join(current_line))
             current_line = [word]
-            
+
     if current_line:
         lines.append(' '.join(current_line))
-        
+
     return lines
 
-def create_lyrics_video(audio_path, segments, output_path="output.mp4", 
-                        bg_image_path=None, font_path=None, 
-                        color_active=(255, 230, 0, 255), 
-                        color_inactive=(200, 200, 200, 180)):
-    print(f"Rendering video to {output_path}...")
-    
-    # Video settings
-    fps = 30
-    width, height = 1920, 1080
-    max_text_width = int(width * 0.8)
-    
-    # Load Font
-    font_size = 60
+def _rasterize_word(word_str, font, x, y):
+    """
+    Rasterizes a word once into a glyph coverage mask.
+    Returns (left, top, mask) where (left, top) is the frame position of the
+    mask; the result matches draw.text((x, y), word_str) pixel for pixel.
+    """
+    l, t, r, b = font.getbbox(word_str)
+    pad = 4 + max(0, -l, -t)
+    frac_x, frac_y = x - int(x), y - int(y)
+
+    mask_img = Image.new('L', (r + 2 * pad, b + 2 * pad), 0)
+    ImageDraw.Draw(mask_img).text((pad + frac_x, pad + frac_y), word_str, font=font, fill=255)
+
+    crop = mask_img.getbbox()
+    if crop is None:
+        return int(x), int(y), np.zeros((0, 0), dtype=np.uint8)
+    mask = np.array(mask_img.crop(crop))
+    return int(x) - pad + crop[0], int(y) - pad + crop[1], mask
+
+def _make_sprite(mask, color, inv_alpha=None):
+    """
+    Precomputed blend terms for a glyph mask drawn in color:
+    (255 - alpha, ink * alpha + 128), both uint16 so a blit needs no
+    per-frame widening of the sprite. inv_alpha, if given, is the first
+    term of another sprite of the same mask and is shared instead of copied.
+    """
+    alpha = mask.astype(np.uint16)[..., None]
+    ink = np.array(color[:3], dtype=np.uint16)
+    if inv_alpha is None:
+        inv_alpha = 255 - alpha
+    return inv_alpha, ink * alpha + 128
+
+def _blit(frame, x, y, sprite, clip=None):
+    """
+    Alpha-composites a sprite onto a 3-channel frame in place, limited to
+    the (y0, y1, x0, x1) clip box if given.
+    Uses the same integer blend as PIL's text drawing; every intermediate
+    fits in uint16 (at most 255 * 255 + 128 before the rounding shift).
+    """
+    inv_alpha, premul = sprite
+    frame_h, frame_w = frame.shape[:2]
+    h, w = premul.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame_w), min(y + h, frame_h)
+    if clip is not None:
+        y0, y1 = max(y0, clip[0]), min(y1, clip[1])
+        x0, x1 = max(x0, clip[2]), min(x1, clip[3])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    region = frame[y0:y1, x0:x1]
+    tmp = region * inv_alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+    tmp += premul[y0 - y:y1 - y, x0 - x:x1 - x]
+    tmp += tmp >> 8
+    tmp >>= 8
+    region[...] = tmp
+
+def _union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+
+def _intersects(a, b):
+    return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+
+class SegmentLayout:
+    """
+    Line breaks, word positions and pre-rasterized word sprites for one segment.
+    Built once per segment; drawing a frame only blits the cached sprites.
+    """
+
+    def __init__(self, segment, font, max_text_width, width, height,
+                 color_active, color_inactive, color_shadow, shadow_offset=2):
+        full_text = segment['text'].strip()
+        lines = wrap_text_pil(full_text, font, max_text_width)
+
+        # Calculate metrics for vertical centering
+        # Get line height
+        bbox = font.getbbox("Tg")
+        line_height = (bbox[3] - bbox[1]) * 1.5 # 1.5 spacing
+        total_text_height = len(lines) * line_height
+
+        start_y = (height - total_text_height) // 2
+
+        # One entry per drawn word: state -> list of (x, y, sprite) layers
+        self.words = []
+        # Per word: (left, ink width) for the karaoke wipe
+        self.extents = []
+
+        for line_idx, line in enumerate(lines):
+            line_words = line.split(' ')
+
+            # Calculate line width to center horizontally
+            line_bbox = font.getbbox(line)
+            line_w = line_bbox[2] - line_bbox[0]
+            start_x = (width - line_w) // 2
+
+            cursor_x = start_x
+            line_y = start_y + (line_idx * line_height)
+
+            for word_str in line_words:
+                if not word_str: continue
+
+                left, top, mask = _rasterize_word(word_str, font, cursor_x, line_y)
+                inactive = _make_sprite(mask, color_inactive)
+                # Every state draws the same mask, so they share one 255 - alpha plane
+                inv_alpha = inactive[0]
+                self.words.append({
+                    # Glow / Stroke for active word: simple shadow first
+                    WORD_ACTIVE: [(left + shadow_offset, top + shadow_offset,
+                                   _make_sprite(mask, color_shadow, inv_alpha)),
+                                  (left, top, _make_sprite(mask, color_active, inv_alpha))],
+                    WORD_SUNG: [(left, top, _make_sprite(mask, (255, 255, 255, 255), inv_alpha))], # Bright White
+                    WORD_INACTIVE: [(left, top, inactive)],
+                })
+                self.extents.append((left, mask.shape[1]))
+
+                # Advance cursor
+                w_bbox = font.getbbox(word_str + " ")
+                w_len = w_bbox[2] - w_bbox[0]
+                cursor_x += w_len
+
+        # (y0, y1, x0, x1) box on screen each word can touch in any state,
+        # and the whole segment's box
+        self.word_boxes = []
+        # Bytes held by the sprites, shared inv_alpha planes counted once
+        self.nbytes = 0
+        for word in self.words:
+            word_box = None
+            inv_alphas = {}
+            for layers in word.values():
+                for x, y, (inv_alpha, premul) in layers:
+                    inv_alphas[id(inv_alpha)] = inv_alpha.nbytes
+                    self.nbytes += premul.nbytes
+                    h, w = premul.shape[:2]
+                    box = (max(y, 0), min(y + h, height), max(x, 0), min(x + w, width))
+                    if box[0] < box[1] and box[2] < box[3]:
+                        word_box = _union(word_box, box)
+            self.word_boxes.append(word_box)
+            self.nbytes += sum(inv_alphas.values())
+        self.bbox = None
+        for word_box in self.word_boxes:
+            self.bbox = _union(self.bbox, word_box)
+
+        # Words whose boxes overlap each word's box (itself included), in draw order
+        self.overlaps = [[j for j, other in enumerate(self.word_boxes)
+                          if box is not None and other is not None and _intersects(box, other)]
+                         for box in self.word_boxes]
+
+    def _draw_word(self, frame, idx, state, clip=None):
+        word = self.words[idx]
+        if state < WORD_WIPE:
+            for x, y, sprite in word[state]:
+                _blit(frame, x, y, sprite, clip)
+            return
+
+        # Karaoke wipe: shadow under the whole word, active fill left of the
+        # wipe column and inactive fill right of it
+        left, ink_w = self.extents[idx]
+        column = left + (state - WORD_WIPE) * ink_w // WIPE_LEVELS
+        clip = clip or (0, frame.shape[0], 0, frame.shape[1])
+        shadow, active = word[WORD_ACTIVE]
+        (x, y, inactive), = word[WORD_INACTIVE]
+        _blit(frame, *shadow, clip)
+        _blit(frame, *active, (clip[0], clip[1], clip[2], min(clip[3], column)))
+        _blit(frame, x, y, inactive, (clip[0], clip[1], max(clip[2], column), clip[3]))
+
+    def draw(self, frame, word_states):
+        """
+        Blits the sprites for the given word states onto a frame whose
+        channel order matches the colors the layout was built with.
+        """
+        for idx, state in enumerate(word_states):
+            self._draw_word(frame, idx, state)
+
+    def update(self, frame, background, old_states, new_states):
+        """
+        Turns a frame showing old_states into one showing new_states by
+        repainting only the boxes of words whose state changed (plus any
+        neighbours overlapping them, clipped to the box).
+        """
+        for idx, (old, new) in enumerate(zip(old_states, new_states)):
+            box = self.word_boxes[idx]
+            if old == new or box is None:
+                continue
+            y0, y1, x0, x1 = box
+            frame[y0:y1, x0:x1] = background[y0:y1, x0:x1]
+            for other in self.overlaps[idx]:
+                self._draw_word(frame, other, new_states[other], box)
+
+# Video settings
+FPS = 30
+WIDTH, HEIGHT = 1920, 1080
+FONT_SIZE = 60
+# Segment layouts (sprites) kept per renderer, at most this many and this
+# many bytes of sprites (a long full-HD line takes several MB)
+MAX_LAYOUTS = 32
+MAX_LAYOUT_BYTES = 64 * 1024 ** 2
+DEFAULT_FONT_PATH = "/System/Library/Fonts/Avenir Next.ttc"
+
+# Low-resolution, low-fps settings for quick previews of the whole song
+DRAFT_RESOLUTION = (854, 480)
+DRAFT_FPS = 10
+DRAFT_ENCODER = {'preset': 'ultrafast', 'crf': 30}
+
+def _load_font(font_path, font_size):
     if not font_path:
-        font_path = "/System/Library/Fonts/Avenir Next.ttc"
-        
+        font_path = DEFAULT_FONT_PATH
+
     try:
-        font = ImageFont.truetype(font_path, font_size, index=0)
+        return load_font(font_path, font_size)
     except Exception as e:
         print(f"Could not load font {font_path}: {e}. Falling back to default.")
-        font = ImageFont.load_default()
-    
-    # Colors
-    color_shadow = (0, 0, 0, 128) # Black shadow
-    
-    # Load background
+        return ImageFont.load_default()
+
+# Named output formats for render_formats; fps/crf/preset default to the
+# create_lyrics_video settings
+OUTPUT_PROFILES = {
+    "landscape": {'resolution': (1920, 1080)},
+    "shorts": {'resolution': (1080, 1920)},
+    "square": {'resolution': (1080, 1080)},
+}
+
+def _layout_scale(resolution):
+    # Sizes are defined for 1080p landscape and follow the short side, so
+    # portrait and square outputs get the same text size as landscape
+    return min(resolution) / HEIGHT
+
+def _load_background(bg_image_path, width, height):
     if bg_image_path and os.path.exists(bg_image_path):
         pil_bg = Image.open(bg_image_path).convert('RGBA')
-        pil_bg = pil_bg.resize((width, height), Image.Resampling.LANCZOS)
+        if abs(pil_bg.width / pil_bg.height / (width / height) - 1) > 0.01:
+            # Other aspect (e.g. a landscape image for shorts): fill and crop, don't stretch
+            pil_bg = ImageOps.fit(pil_bg, (width, height), Image.Resampling.LANCZOS)
+        else:
+            pil_bg = pil_bg.resize((width, height), Image.Resampling.LANCZOS)
         # Darken overlay
         overlay = Image.new('RGBA', (width, height), (0, 0, 0, 100))
         pil_bg = Image.alpha_composite(pil_bg, overlay)
     else:
         # Default gradient or solid color
         pil_bg = Image.new('RGBA', (width, height), (20, 20, 30, 255))
-        
+    return pil_bg
+
+def _bgr(color):
+    return (color[2], color[1], color[0]) + tuple(color[3:])
+
+class FrameRenderer:
+    """
+    Holds everything needed to turn an on-screen state into a BGR frame:
+    font, background and the per-segment layout cache.
+    Sizes are defined for 1080p and scaled to the requested resolution
+    (by its short side). timing lets several renderers share one TimingIndex.
+    """
+
+    def __init__(self, segments, bg_image_path=None, font_path=None,
+                 color_active=(255, 230, 0, 255),
+                 color_inactive=(200, 200, 200, 180),
+                 resolution=(WIDTH, HEIGHT), karaoke_wipe=False, timing=None):
+        self.segments = segments
+        self.width, self.height = resolution
+        self.max_text_width = int(self.width * 0.8)
+        scale = _layout_scale(resolution)
+        self.font = _load_font(font_path, max(1, round(FONT_SIZE * scale)))
+        self.shadow_offset = max(1, round(2 * scale))
+        self.timing = timing or TimingIndex(segments, wipe=karaoke_wipe)
+
+        # Colors
+        self.color_active = color_active
+        self.color_inactive = color_inactive
+        self.color_shadow = (0, 0, 0, 128) # Black shadow
+
+        # Frames are composited directly in BGR (what ffmpeg/OpenCV take), so
+        # the background and sprite colors are converted once up front
+        pil_bg = _load_background(bg_image_path, self.width, self.height)
+        self.bg_bgr = np.ascontiguousarray(np.array(pil_bg.convert('RGB'))[..., ::-1])
+        # Reused output buffer; only the text box of the last state is dirty
+        self._frame = self.bg_bgr.copy()
+        self._dirty = None
+        self._shown = None
+        self._lock = threading.Lock()
+
+        self.layouts = OrderedDict()
+        self._layout_bytes = 0
+
+    def set_segments(self, segments, timing=None):
+        """
+        Switches to another segment list (e.g. the next window of a streamed
+        render). Cached layouts are dropped and the next state is drawn
+        from scratch.
+        """
+        with self._lock:
+            self.segments = segments
+            self.timing = timing or TimingIndex(segments, wipe=self.timing.wipe)
+            self.layouts.clear()
+            self._layout_bytes = 0
+            if self._dirty is not None:
+                y0, y1, x0, x1 = self._dirty
+                self._frame[y0:y1, x0:x1] = self.bg_bgr[y0:y1, x0:x1]
+                self._dirty = None
+            self._shown = None
+
+    def layout(self, seg_idx):
+        if seg_idx in self.layouts:
+            self.layouts.move_to_end(seg_idx)
+        else:
+            count("layouts_built")
+            self.layouts[seg_idx] = SegmentLayout(
+                self.segments[seg_idx], self.font, self.max_text_width,
+                self.width, self.height, _bgr(self.color_active),
+                _bgr(self.color_inactive), self.color_shadow, self.shadow_offset)
+            self._layout_bytes += self.layouts[seg_idx].nbytes
+            # Segments play in order, so only recent layouts get reused
+            while len(self.layouts) > 1 and (len(self.layouts) > MAX_LAYOUTS
+                                             or self._layout_bytes > MAX_LAYOUT_BYTES):
+                _, evicted = self.layouts.popitem(last=False)
+                self._layout_bytes -= evicted.nbytes
+        return self.layouts[seg_idx]
+
+    def render_state(self, state):
+        """
+        The BGR frame for a state. Only the text box of the previous state
+        is restored from the background and the new state drawn on top (or,
+        within a segment, only the words that changed), so no full-frame
+        copies or color conversions happen per state.
+        The returned array is reused: it is valid until the next call.
+        """
+        frame = self._frame
+        layout = self.layout(state[0]) if state is not None else None
+        if self._dirty is None and layout is None:
+            return frame
+
+        count("states_rendered")
+        if self._dirty is not None and state is not None and self._shown[0] == state[0]:
+            # Same segment: only words that changed state (e.g. the one being
+            # wiped) are repainted
+            layout.update(frame, self.bg_bgr, self._shown[1], state[1])
+            self._shown = state
+            return frame
+
+        if self._dirty is not None:
+            y0, y1, x0, x1 = self._dirty
+            frame[y0:y1, x0:x1] = self.bg_bgr[y0:y1, x0:x1]
+            self._dirty = None
+            self._shown = None
+        if layout is not None and layout.bbox is not None:
+            layout.draw(frame, state[1])
+            self._dirty = layout.bbox
+            self._shown = state
+        return frame
+
+    def frame_at(self, current_time):
+        """
+        The BGR frame shown at current_time (seconds).
+        Returns a copy, so one renderer can serve several threads.
+        """
+        with self._lock:
+            return self.render_state(self.timing.state_at(current_time)).copy()
+
+def render_frame(segments, current_time, bg_image_path=None, font_path=None,
+                 color_active=(255, 230, 0, 255),
+                 color_inactive=(200, 200, 200, 180),
+                 resolution=(WIDTH, HEIGHT), karaoke_wipe=False):
+    """
+    Renders the single frame shown at current_time, using the same layout and
+    compositing as the video. Returns an RGB PIL image.
+    For repeated previews keep a FrameRenderer and call frame_at instead.
+    """
+    renderer = FrameRenderer(segments, bg_image_path, font_path,
+                             color_active, color_inactive, resolution, karaoke_wipe)
+    return Image.fromarray(np.ascontiguousarray(renderer.frame_at(current_time)[..., ::-1]))
+
+def _total_frames(segments, fps):
     # Duration
     last_end = segments[-1]['end'] if segments else 10
-    total_frames = int((last_end + 3) * fps)
-    
-    # Video Writer
-    temp_video = "temp_video.mp4" # mp4 slightly better container for intermediate
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(temp_video, fourcc, fps, (width, height))
-    
-    print(f"Total frames: {total_frames}")
-    
-    for i in range(total_frames):
-        current_time = i / fps
-        
-        # 1. Create canvas from background
-        # We process in RGBA for transparency tricks, convert to BGR for OpenCV
-        canvas = pil_bg.copy()
-        draw = ImageDraw.Draw(canvas)
-        
-        # 2. Find Segment
-        current_segment = None
-        for seg in segments:
-            if seg['start'] <= current_time <= seg['end']:
-                current_segment = seg
-                break
-                
-        if current_segment:
-            full_text = current_segment['text'].strip()
-            words_info = current_segment.get('words', [])
-            
-            lines = wrap_text_pil(full_text, font, max_text_width)
-            
-            # Calculate metrics for vertical centering
-            # Get line height
-            bbox = font.getbbox("Tg")
-            line_height = (bbox[3] - bbox[1]) * 1.5 # 1.5 spacing
-            total_text_height = len(lines) * line_height
-            
-            start_y = (height - total_text_height) // 2
-            
-            current_word_idx = 0
-            
-            for line_idx, line in enumerate(lines):
-                line_words = line.split(' ')
-                
-                # Calculate line width to center horizontally
-                line_bbox = font.getbbox(line)
-                line_w = line_bbox[2] - line_bbox[0]
-                start_x = (width - line_w) // 2
-                
-                cursor_x = start_x
-                line_y = start_y + (line_idx * line_height)
-                
-                for word_str in line_words:
-                    if not word_str: continue
-                    
-                    # Timing Check
-                    t_start, t_end = 0, 0
-                    if current_word_idx < len(words_info):
-                        w_obj = words_info[current_word_idx]
-                        t_start = w_obj['start']
-                        t_end = w_obj['end']
-                        current_word_idx += 1
-                        
-                    is_active = (t_start <= current_time <= t_end)
-                    is_sung = (current_time > t_end)
-                    
-                    # Draw Color
-                    if is_active:
-                        fill_color = color_active
-                        # Glow / Stroke for active word
-                        # Simple shadow first
-                        draw.text((cursor_x + 2, line_y + 2), word_str, font=font, fill=color_shadow)
-                    elif is_sung:
-                        fill_color = (255, 255, 255, 255) # Bright White
-                    else:
-                        fill_color = color_inactive
-                        
-                    draw.text((cursor_x, line_y), word_str, font=font, fill=fill_color)
-                    
-                    # Advance cursor
-                    w_bbox = font.getbbox(word_str + " ")
-                    w_len = w_bbox[2] - w_bbox[0]
-                    cursor_x += w_len
-
-        # Convert PIL -> OpenCV (RGB -> BGR)
-        frame_np = np.array(canvas.convert('RGB'))
-        frame_bgr = cv2.cvtColor(frame_np, cv2.COLOR_RGB2BGR)
-        
-        out.write(frame_bgr)
-        
-        if i % 50 == 0:
-            print(f"Rendered {i}/{total_frames}", end='\r')
-            
-    out.release()
-    print("\nEncoding final video...")
-    
-    cmd = [
-        'ffmpeg', '-y',
-        '-i', temp_video,
+    return int((last_end + 3) * fps)
+
+def plan_chunks(runs, total_frames, n_chunks):
+    """
+    Splits the timeline into about n_chunks frame ranges [start, end).
+    Cuts are placed where the screen is empty (between segments) whenever
+    possible, so a segment is laid out by a single worker.
+    """
+    if n_chunks <= 1 or total_frames == 0:
+        return [(0, total_frames)]
+
+    target = total_frames / n_chunks
+    gap_starts = [first for state, first, _ in runs if state is None and first > 0]
+    any_starts = [first for _, first, _ in runs if first > 0]
+
+    cuts = []
+    for k in range(1, n_chunks):
+        ideal = k * target
+        candidates = gap_starts or any_starts
+        if not candidates:
+            break
+        cut = min(candidates, key=lambda f: abs(f - ideal))
+        # Fall back to any state change when the nearest gap is far away
+        if abs(cut - ideal) > target / 2 and any_starts:
+            cut = min(any_starts, key=lambda f: abs(f - ideal))
+        if not cuts or cut > cuts[-1]:
+            cuts.append(cut)
+
+    bounds = [0] + cuts + [total_frames]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+class RenderCancelled(Exception):
+    """
+    Raised out of a render that was stopped through its cancel token.
+    """
+
+def _check_cancel(cancel):
+    # cancel: anything with is_set(), e.g. a threading.Event
+    if cancel is not None and cancel.is_set():
+        raise RenderCancelled("Render cancelled")
+
+class _Progress:
+    """
+    Builds progress events: frames done out of the total, frames/sec since
+    the render started and the ETA at that rate. total_frames may be None
+    until it is known (streamed renders); progress and ETA are None until then. tick() returns at most one
+    event per interval seconds, so frame loops can call it freely.
+    """
+
+    def __init__(self, total_frames, interval=0.5):
+        self.total_frames = total_frames
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last = 0.0
+        # Frames done without rendering (reused chunks) don't count for fps
+        self.skipped = 0
+
+    def event(self, stage, frame=None):
+        elapsed = time.perf_counter() - self.started
+        self._last = elapsed
+        event = {'stage': stage, 'frame': frame, 'total_frames': self.total_frames,
+                 'progress': None, 'fps': None, 'eta': None}
+        if frame is None:
+            return event
+        rate = (frame - self.skipped) / elapsed if elapsed > 0 else 0
+        if rate > 0:
+            event['fps'] = round(rate, 1)
+        if self.total_frames:
+            event['progress'] = min(1.0, frame / self.total_frames)
+            if rate > 0:
+                event['eta'] = round(max(0, self.total_frames - frame) / rate, 1)
+        return event
+
+    def tick(self, stage, frame):
+        """
+        An event if interval seconds passed since the last one, else None.
+        """
+        if time.perf_counter() - self.started - self._last < self.interval:
+            return None
+        return self.event(stage, frame)
+
+def _run_ffmpeg(cmd, progress, stage, cancel=None, cwd=None, track_frames=True):
+    """
+    Runs an ffmpeg command, checking cancel whenever it reports -progress
+    (about twice a second). With track_frames its frame count is yielded
+    as progress events; otherwise a single event marks the stage.
+    ffmpeg is killed if the render is cancelled or abandoned.
+    """
+    if not track_frames:
+        yield progress.event(stage, progress.total_frames)
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    # stderr goes to a temp file so a chatty ffmpeg can never fill a pipe and stall
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            for line in proc.stdout:
+                _check_cancel(cancel)
+                key, _, value = line.decode(errors='replace').strip().partition('=')
+                if track_frames and key == 'frame' and value.isdigit():
+                    event = progress.tick(stage, int(value))
+                    if event:
+                        yield event
+            returncode = proc.wait()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdout.close()
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()
+            raise RuntimeError(f"ffmpeg failed ({returncode}): {message}")
+
+def _render_chunk(job, cancel=None):
+    """
+    Worker entry point: renders frames [start, end) to a video-only chunk.
+    A chunk that fails or is cancelled halfway is deleted.
+    """
+    renderer = FrameRenderer(job['segments'], **job['style'])
+    runs = renderer.timing.state_runs(job['fps'], job['end'], first_frame=job['start'])
+
+    try:
+        with FFmpegWriter(job['chunk_path'], renderer.width, renderer.height, job['fps'],
+                          **job['encoder']) as out:
+            for state, _, n_frames in runs:
+                _check_cancel(cancel)
+                frame_bgr = renderer.render_state(state)
+                for _ in range(n_frames):
+                    out.write(frame_bgr)
+    except BaseException:
+        if os.path.exists(job['chunk_path']):
+            os.remove(job['chunk_path'])
+        raise
+    return job['chunk_path']
+
+def _run_chunks(jobs, workers, progress, cancel=None):
+    """
+    Renders chunk jobs, in this process or on a process pool, yielding a
+    progress event as each chunk finishes. Cancelling drops the queued
+    chunks and stops the workers mid-chunk (their ffmpeg children exit
+    when the pipe closes).
+    """
+    frames_done = progress.skipped
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _render_chunk(job, cancel)
+            frames_done += job['end'] - job['start']
+            yield progress.event("chunks", frames_done)
+        return
+
+    # Spawned, not forked: renders can start from a thread (batch mode) while
+    # other threads hold locks, e.g. inside torch
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = {pool.submit(_render_chunk, job): job for job in jobs}
+        while pending:
+            done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            _check_cancel(cancel)
+            for future in done:
+                job = pending.pop(future)
+                future.result()
+                frames_done += job['end'] - job['start']
+                yield progress.event("chunks", frames_done)
+    except BaseException:
+        # The executor has no public way to stop running tasks
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        raise
+    pool.shutdown()
+
+def _concat_cmd(chunk_paths, audio_path, output_path, work_dir):
+    list_path = os.path.join(work_dir, "chunks.txt")
+    with open(list_path, "w") as f:
+        for chunk_path in chunk_paths:
+            f.write(f"file '{os.path.abspath(chunk_path)}'\n")
+
+    return [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', list_path,
         '-i', audio_path,
-        '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
-        '-c:a', 'aac', '-b:a', '192k',
+        '-c:v', 'copy',
+        *mux_audio_args(audio_path),
         '-shortest',
         output_path
     ]
-    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    
-    if os.path.exists(temp_video):
-        os.remove(temp_video)
-    
+
+def _render_parallel(audio_path, segments, output_path, style, encoder,
+                     runs, total_frames, fps, workers, progress, cancel=None):
+    # More chunks than workers keeps every core busy until the end
+    chunks = plan_chunks(runs, total_frames, workers * 2)
+    print(f"Rendering {len(chunks)} chunks on {workers} workers...")
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_chunks_")
+    try:
+        jobs = [{
+            'segments': segments,
+            'style': style,
+            'encoder': encoder,
+            'fps': fps,
+            'start': start,
+            'end': end,
+            'chunk_path': os.path.join(work_dir, f"chunk_{idx:04d}.mp4"),
+        } for idx, (start, end) in enumerate(chunks)]
+
+        with span("render_chunks", chunks=len(jobs)):
+            yield from _run_chunks(jobs, workers, progress, cancel)
+
+        print("\nJoining chunks...")
+        with span("concat_chunks"):
+            chunk_paths = [job['chunk_path'] for job in jobs]
+            yield from _run_ffmpeg(_concat_cmd(chunk_paths, audio_path, output_path, work_dir),
+                                   progress, "concat", cancel, track_frames=False)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Incremental renders cut the timeline on a fixed grid, so an edit only
+# invalidates the chunks whose frames it changes
+INCREMENTAL_CHUNK_SECONDS = 10
+
+def _style_key(style, encoder, fps):
+    """
+    Hash of everything besides the lyrics that affects the encoded pixels.
+    Background and font files are identified by content.
+    """
+    desc = dict(style, encoder=encoder, fps=fps)
+    for name in ('bg_image_path', 'font_path'):
+        path = style.get(name)
+        desc[name] = file_hash(path) if path and os.path.exists(path) else path
+    return hashlib.sha256(json.dumps(desc, sort_keys=True, default=list).encode()).hexdigest()
+
+def _chunk_key(style_key, segments, timing, fps, start, end):
+    """
+    Hash of what frames [start, end) show: each run's segment text, word
+    states and position relative to the chunk. Identical chunks (e.g. empty
+    stretches) share a key wherever they sit on the timeline.
+    """
+    runs = []
+    for state, first, n_frames in timing.state_runs(fps, end, first_frame=start):
+        if state is not None:
+            state = (segments[state[0]]['text'].strip(), list(state[1]))
+        runs.append((state, first - start, n_frames))
+    payload = json.dumps([style_key, end - start, runs])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _render_incremental(audio_path, segments, output_path, style, encoder,
+                        timing, total_frames, fps, workers, progress, cancel=None,
+                        chunk_dir=None, chunk_seconds=INCREMENTAL_CHUNK_SECONDS):
+    """
+    Renders on a fixed chunk grid and keeps the chunks in chunk_dir
+    (default <output>.chunks/, with a manifest of chunk hash -> file). Later
+    renders only encode chunks whose hash changed; the rest are reused and
+    spliced in with concat copy.
+    """
+    chunk_dir = chunk_dir or os.path.splitext(output_path)[0] + ".chunks"
+    os.makedirs(chunk_dir, exist_ok=True)
+    manifest_path = os.path.join(chunk_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            print("Render manifest unreadable, rendering everything.")
+
+    style_key = _style_key(style, encoder, fps)
+    chunk_frames = max(1, int(chunk_seconds * fps))
+    chunks = []
+    for start in range(0, total_frames, chunk_frames):
+        end = min(start + chunk_frames, total_frames)
+        chunks.append((start, end, _chunk_key(style_key, segments, timing, fps, start, end)))
+
+    jobs = {}
+    for start, end, key in chunks:
+        file_name = manifest.get(key)
+        if key in jobs or (file_name and os.path.exists(os.path.join(chunk_dir, file_name))):
+            continue
+        jobs[key] = {
+            'segments': segments,
+            'style': style,
+            'encoder': encoder,
+            'fps': fps,
+            'start': start,
+            'end': end,
+            'chunk_path': os.path.join(chunk_dir, f"{key[:16]}.mp4"),
+        }
+    count("chunks_reused", len(chunks) - len(jobs))
+    count("chunks_rendered", len(jobs))
+    print(f"{len(jobs)} of {len(chunks)} chunks changed")
+
+    # Reused chunks count as done from the start
+    progress.skipped = total_frames - sum(job['end'] - job['start'] for job in jobs.values())
+    yield progress.event("chunks", progress.skipped)
+    with span("render_chunks", chunks=len(jobs)):
+        yield from _run_chunks(list(jobs.values()), workers, progress, cancel)
+
+    # Only chunks of the current render are kept
+    manifest = {key: manifest.get(key) or os.path.basename(jobs[key]['chunk_path'])
+                for _, _, key in chunks}
+    for file_name in os.listdir(chunk_dir):
+        if file_name.endswith(".mp4") and file_name not in manifest.values():
+            os.remove(os.path.join(chunk_dir, file_name))
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    print("\nJoining chunks...")
+    with span("concat_chunks"):
+        chunk_paths = [os.path.join(chunk_dir, manifest[key]) for _, _, key in chunks]
+        yield from _run_ffmpeg(_concat_cmd(chunk_paths, audio_path, output_path, chunk_dir),
+                               progress, "concat", cancel, track_frames=False)
+
+def _write_vfr(runs, renderer, fps, audio_path, output_path, progress, cancel=None,
+               preset="medium", crf=23, threads=0):
+    """
+    Writes one image per state with its real duration and lets ffmpeg
+    encode them as a variable-frame-rate video.
+    """
+    import cv2
+
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_vfr_")
+    try:
+        concat_path = os.path.join(work_dir, "frames.txt")
+        with open(concat_path, "w") as f:
+            frame_file = None
+            for run_idx, (state, first_frame, n_frames) in enumerate(runs):
+                _check_cancel(cancel)
+                frame_file = os.path.join(work_dir, f"state_{run_idx:06d}.png")
+                cv2.imwrite(frame_file, renderer.render_state(state))
+                f.write(f"file '{frame_file}'\n")
+                f.write(f"duration {n_frames / fps:.6f}\n")
+                event = progress.tick("frames", first_frame + n_frames)
+                if event:
+                    yield event
+            # The concat demuxer ignores the duration of the last entry
+            # unless the file is listed once more
+            if frame_file:
+                f.write(f"file '{frame_file}'\n")
+
+        print("\nEncoding final video...")
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'concat', '-safe', '0', '-i', concat_path,
+            '-i', audio_path,
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p', '-vsync', 'vfr', '-threads', str(threads),
+            *mux_audio_args(audio_path),
+            '-shortest',
+            output_path
+        ]
+        with span("ffmpeg_encode"):
+            yield from _run_ffmpeg(cmd, progress, "encode", cancel, track_frames=False)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _ass_style(style):
+    """
+    write_ass arguments that match FrameRenderer for a render style: same
+    font and size, PIL-measured line breaks, colors and shadow depth.
+    """
+    width, height = style['resolution']
+    scale = _layout_scale(style['resolution'])
+    font = _load_font(style['font_path'], max(1, round(FONT_SIZE * scale)))
+    max_text_width = int(width * 0.8)
+    family, variant = font.getname() if hasattr(font, 'getname') else ("Sans", "Regular")
+    return {
+        'font_name': family,
+        # libass sizes fonts by ascent + descent, PIL by the em square
+        'font_size': sum(font.getmetrics()) if hasattr(font, 'getmetrics') else FONT_SIZE,
+        'bold': 'Bold' in variant,
+        'italic': 'Italic' in variant or 'Oblique' in variant,
+        'color_active': style['color_active'],
+        'color_inactive': style['color_inactive'],
+        'resolution': (width, height),
+        'karaoke_wipe': style['karaoke_wipe'],
+        'shadow_depth': max(1, round(2 * scale)),
+        'wrap': lambda text: wrap_text_pil(text, font, max_text_width),
+    }
+
+def _render_ass(audio_path, segments, output_path, style, total_frames, fps, progress, cancel=None,
+                preset="medium", crf=23, threads=0):
+    """
+    Subtitle backend: writes the lyrics as an ASS karaoke script and lets
+    ffmpeg burn it (libass) over the looped background in one encode, with
+    no Python frame loop. Text is drawn by libass rather than PIL, so it
+    is close to, not pixel-identical with, the frame backend.
+    """
+    width, height = style['resolution']
+    work_dir = tempfile.mkdtemp(prefix="genlyrics_ass_")
+    try:
+        _load_background(style['bg_image_path'], width, height).convert('RGB').save(
+            os.path.join(work_dir, "background.png"))
+        write_ass(segments, os.path.join(work_dir, "lyrics.ass"), **_ass_style(style))
+        # libass finds the font by family name in fontsdir
+        font_dir = os.path.join(work_dir, "fonts")
+        os.makedirs(font_dir)
+        font_path = style['font_path'] or DEFAULT_FONT_PATH
+        if os.path.exists(font_path):
+            shutil.copy(font_path, font_dir)
+
+        # Runs inside work_dir so the filter arguments need no path escaping
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-loop', '1', '-framerate', str(fps), '-i', "background.png",
+            '-i', os.path.abspath(audio_path),
+            '-vf', "subtitles=lyrics.ass:fontsdir=fonts",
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p', '-threads', str(threads),
+            *mux_audio_args(audio_path),
+            '-t', f"{total_frames / fps:.3f}", '-shortest',
+            os.path.abspath(output_path)
+        ]
+        with span("ffmpeg_burn_in"):
+            try:
+                yield from _run_ffmpeg(cmd, progress, "burn_in", cancel, cwd=work_dir)
+            except RuntimeError as e:
+                raise RuntimeError(f"Subtitle burn-in failed (is ffmpeg built with libass?): {e}") from e
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+RENDER_BACKENDS = ("frames", "ass")
+
+def _remove_partial(path, stamp):
+    # Only removes a file this render wrote; an older finished video stays
+    try:
+        if os.stat(path).st_mtime_ns != stamp:
+            os.remove(path)
+    except OSError:
+        pass
+
+def render_lyrics_video(audio_path, segments, output_path="output.mp4",
+                        bg_image_path=None, font_path=None,
+                        color_active=(255, 230, 0, 255),
+                        color_inactive=(200, 200, 200, 180),
+                        variable_frame_rate=False,
+                        preset="medium", crf=23, threads=0, workers=1,
+                        resolution=(WIDTH, HEIGHT), fps=FPS, draft=False,
+                        incremental=False, chunk_dir=None, karaoke_wipe=False,
+                        backend="frames", sidecars=False, cancel=None):
+    """
+    Renders the lyrics video step by step, yielding progress events:
+    {'stage', 'frame', 'total_frames', 'progress' (0..1), 'fps', 'eta' (s)},
+    where progress/fps/eta are None while a stage can't tell. The last
+    event has stage "done".
+    cancel is an optional token with is_set() (e.g. threading.Event),
+    checked between frames, chunks and ffmpeg progress reports; a set
+    token raises RenderCancelled. On cancel, error or when the generator
+    is closed early, ffmpeg children and render workers are stopped and
+    temp files and the partial output are removed.
+    Options are the same as for create_lyrics_video.
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"Unknown render backend: {backend}")
+    print(f"Rendering video to {output_path}...")
+    stamp = os.stat(output_path).st_mtime_ns if os.path.exists(output_path) else None
+
+    encoder = {'preset': preset, 'crf': crf, 'threads': threads}
+    if draft:
+        resolution, fps = DRAFT_RESOLUTION, DRAFT_FPS
+        encoder.update(DRAFT_ENCODER)
+
+    style = {
+        'bg_image_path': bg_image_path,
+        'font_path': font_path,
+        'color_active': color_active,
+        'color_inactive': color_inactive,
+        'resolution': tuple(resolution),
+        'karaoke_wipe': karaoke_wipe,
+    }
+
+    total_frames = _total_frames(segments, fps)
+    progress = _Progress(total_frames)
+    yield progress.event("setup")
+
+    try:
+        if sidecars:
+            paths = export_subtitles(segments, output_path, **_ass_style(style))
+            print(f"Subtitles: {', '.join(paths.values())}")
+
+        if backend == "ass":
+            yield from _render_ass(audio_path, segments, output_path, style, total_frames, fps,
+                                   progress, cancel, **encoder)
+            print(f"Done! {output_path}")
+            yield progress.event("done", total_frames)
+            return
+
+        # Work out when the picture actually changes
+        with span("timing_index"):
+            timing = TimingIndex(segments, wipe=karaoke_wipe)
+            runs = timing.state_runs(fps, total_frames)
+        count("frames", total_frames)
+        count("unique_states", len(runs))
+        print(f"Total frames: {total_frames} ({len(runs)} unique states)")
+        _check_cancel(cancel)
+
+        if incremental and not variable_frame_rate:
+            yield from _render_incremental(audio_path, segments, output_path, style, encoder,
+                                           timing, total_frames, fps, workers, progress, cancel,
+                                           chunk_dir)
+        elif workers > 1 and not variable_frame_rate:
+            yield from _render_parallel(audio_path, segments, output_path, style, encoder,
+                                        runs, total_frames, fps, workers, progress, cancel)
+        else:
+            with span("renderer_setup"):
+                renderer = FrameRenderer(segments, **style)
+
+            if variable_frame_rate:
+                yield from _write_vfr(runs, renderer, fps, audio_path, output_path,
+                                      progress, cancel, **encoder)
+            else:
+                # Frames stream straight into one ffmpeg encode that also muxes the audio
+                with FFmpegWriter(output_path, renderer.width, renderer.height, fps,
+                                  audio_path=audio_path, **encoder) as out:
+                    with span("frame_loop"):
+                        for state, first_frame, n_frames in runs:
+                            _check_cancel(cancel)
+                            frame_bgr = renderer.render_state(state)
+                            for _ in range(n_frames):
+                                out.write(frame_bgr)
+                            event = progress.tick("frames", first_frame + n_frames)
+                            if event:
+                                yield event
+
+                    print("\nFinishing encode...")
+                    yield progress.event("finish", total_frames)
+    except BaseException:
+        _remove_partial(output_path, stamp)
+        raise
+
     print(f"Done! {output_path}")
+    yield progress.event("done", total_frames)
+
+def _print_progress(event):
+    if event['frame'] is None or event['stage'] == "done":
+        return
+    line = f"[{event['stage']}] {event['frame']}"
+    if event['total_frames']:
+        line += f"/{event['total_frames']}"
+    if event['fps']:
+        line += f"  {event['fps']:.0f} fps"
+    if event['eta'] is not None:
+        line += f", ETA {event['eta']:.0f}s"
+    print(line, end='\r')
+
+@traced("create_lyrics_video")
+def create_lyrics_video(audio_path, segments, output_path="output.mp4",
+                        bg_image_path=None, font_path=None,
+                        color_active=(255, 230, 0, 255),
+                        color_inactive=(200, 200, 200, 180),
+                        variable_frame_rate=False,
+                        preset="medium", crf=23, threads=0, workers=1,
+                        resolution=(WIDTH, HEIGHT), fps=FPS, draft=False,
+                        incremental=False, chunk_dir=None, karaoke_wipe=False,
+                        backend="frames", sidecars=False, cancel=None, on_progress=None):
+    """
+    Renders the lyrics video.
+    Frames are grouped into runs of identical on-screen state; each state is
+    drawn once and repeated for the length of its run. With
+    variable_frame_rate=True every state is written once with its real duration.
+    preset, crf and threads are passed through to libx264.
+    workers > 1 renders time ranges in separate processes and joins the chunks.
+    draft=True renders a quick low-resolution, low-fps preview (DRAFT_* settings).
+    incremental=True keeps fixed-size encoded chunks next to the output and
+    on later calls re-encodes only the chunks whose lyrics or style changed
+    (chunk_dir overrides where they are kept).
+    karaoke_wipe=True fills each word from left to right while it is sung
+    instead of switching its color at once.
+    backend="ass" skips the frame loop: the lyrics become an ASS karaoke
+    script that ffmpeg burns in over the background in a single encode.
+    sidecars=True also writes <output>.srt/.ass/.lrc next to the video.
+    on_progress(event) is called with every render_lyrics_video event
+    (progress is printed when it is not given); cancel is a token as
+    described there.
+    """
+    events = render_lyrics_video(
+        audio_path, segments, output_path, bg_image_path=bg_image_path, font_path=font_path,
+        color_active=color_active, color_inactive=color_inactive,
+        variable_frame_rate=variable_frame_rate, preset=preset, crf=crf, threads=threads,
+        workers=workers, resolution=resolution, fps=fps, draft=draft, incremental=incremental,
+        chunk_dir=chunk_dir, karaoke_wipe=karaoke_wipe, backend=backend, sidecars=sidecars,
+        cancel=cancel)
+    try:
+        for event in events:
+            if on_progress is not None:
+                on_progress(event)
+            else:
+                _print_progress(event)
+    finally:
+        # Runs the render's cleanup right away if the callback raised
+        events.close()
+
+def _resolve_profile(profile):
+    if isinstance(profile, str):
+        if profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile: {profile}")
+        profile = OUTPUT_PROFILES[profile]
+    return dict({'fps': FPS, 'crf': 23, 'preset': "medium"}, **profile)
+
+def render_formats(audio_path, segments, outputs, bg_image_path=None, font_path=None,
+                   color_active=(255, 230, 0, 255),
+                   color_inactive=(200, 200, 200, 180),
+                   karaoke_wipe=False, threads=0, sidecars=False, cancel=None):
+    """
+    Renders one video per output profile in a single pass over the timeline.
+    outputs: list of (output_path, profile), where profile is a name from
+    OUTPUT_PROFILES or a dict with 'resolution' and optionally 'fps', 'crf'
+    and 'preset'. Word states are computed once (per frame rate) and shared;
+    each profile gets its own scaled layout and its own ffmpeg encoder, all
+    fed from the same loop and muxing the same audio. sidecars=True writes
+    subtitle files next to the first output.
+    Yields progress events and handles cancel like render_lyrics_video.
+    """
+    targets = [(path, _resolve_profile(profile)) for path, profile in outputs]
+    stamps = {path: os.stat(path).st_mtime_ns if os.path.exists(path) else None for path, _ in targets}
+    by_fps = {}
+    for path, profile in targets:
+        by_fps.setdefault(profile['fps'], []).append((path, profile))
+
+    with span("timing_index"):
+        timing = TimingIndex(segments, wipe=karaoke_wipe)
+    progress = _Progress(sum(_total_frames(segments, fps) for fps in by_fps))
+    print(f"Rendering {len(targets)} formats in {len(by_fps)} pass(es)...")
+    yield progress.event("setup")
+
+    if sidecars:
+        path, profile = targets[0]
+        style = {'font_path': font_path, 'color_active': color_active, 'color_inactive': color_inactive,
+                 'resolution': profile['resolution'], 'karaoke_wipe': karaoke_wipe}
+        paths = export_subtitles(segments, path, **_ass_style(style))
+        print(f"Subtitles: {', '.join(paths.values())}")
+
+    done_frames = 0
+    try:
+        for fps, group in by_fps.items():
+            total_frames = _total_frames(segments, fps)
+            runs = timing.state_runs(fps, total_frames)
+            count("unique_states", len(runs))
+            with contextlib.ExitStack() as stack:
+                encoders = []
+                for path, profile in group:
+                    with span("renderer_setup"):
+                        renderer = FrameRenderer(segments, bg_image_path, font_path, color_active,
+                                                 color_inactive, profile['resolution'], karaoke_wipe,
+                                                 timing=timing)
+                    out = stack.enter_context(FFmpegWriter(
+                        path, renderer.width, renderer.height, fps, audio_path=audio_path,
+                        preset=profile['preset'], crf=profile['crf'], threads=threads))
+                    encoders.append((renderer, out))
+
+                with span("frame_loop", formats=len(encoders)):
+                    for state, first_frame, n_frames in runs:
+                        _check_cancel(cancel)
+                        for renderer, out in encoders:
+                            frame_bgr = renderer.render_state(state)
+                            for _ in range(n_frames):
+                                out.write(frame_bgr)
+                        event = progress.tick("frames", done_frames + first_frame + n_frames)
+                        if event:
+                            yield event
+                done_frames += total_frames
+                yield progress.event("finish", done_frames)
+    except BaseException:
+        for path, stamp in stamps.items():
+            _remove_partial(path, stamp)
+        raise
+
+    for path, _ in targets:
+        print(f"Done! {path}")
+    yield progress.event("done", progress.total_frames)
+
+@traced("create_format_videos")
+def create_format_videos(audio_path, segments, outputs, bg_image_path=None, font_path=None,
+                         color_active=(255, 230, 0, 255),
+                         color_inactive=(200, 200, 200, 180),
+                         karaoke_wipe=False, threads=0, sidecars=False, cancel=None, on_progress=None):
+    """
+    Blocking render_formats: prints progress or passes every event to
+    on_progress(event).
+    """
+    events = render_formats(audio_path, segments, outputs, bg_image_path, font_path,
+                            color_active, color_inactive, karaoke_wipe, threads, sidecars, cancel)
+    try:
+        for event in events:
+            if on_progress is not None:
+                on_progress(event)
+            else:
+                _print_progress(event)
+    finally:
+        events.close()
+
+# Seconds of video laid out per step of a streamed render
+STREAM_WINDOW_SECONDS = 60
+
+def render_stream(audio_path, segments, output_path="output.mp4",
+                  bg_image_path=None, font_path=None,
+                  color_active=(255, 230, 0, 255),
+                  color_inactive=(200, 200, 200, 180),
+                  preset="medium", crf=23, threads=0,
+                  resolution=(WIDTH, HEIGHT), fps=FPS, karaoke_wipe=False, sidecars=False,
+                  cancel=None, window=STREAM_WINDOW_SECONDS):
+    """
+    Renders from an iterable of segments in start order, e.g. a transcript
+    that is still being produced, with memory that does not grow with the
+    length of the song. The timeline is laid out window seconds at a time:
+    only segments that can be on screen in the current window are held,
+    and each window's frames go straight to the encoder before the next
+    segments are read. Frames are the same as render_lyrics_video's.
+    The length is only known once the segments run out, so events carry
+    no progress or ETA until then. sidecars=True keeps the (text-only)
+    segments and writes subtitle files next to the video at the end.
+    Yields progress events and handles cancel like render_lyrics_video.
+    """
+    print(f"Rendering video to {output_path} (streaming)...")
+    stamp = os.stat(output_path).st_mtime_ns if os.path.exists(output_path) else None
+    segments = iter(segments)
+    window_frames = max(1, int(window * fps))
+    progress = _Progress(None)
+    yield progress.event("setup")
+
+    try:
+        with span("renderer_setup"):
+            renderer = FrameRenderer([], bg_image_path, font_path, color_active, color_inactive,
+                                     resolution, karaoke_wipe)
+        with FFmpegWriter(output_path, renderer.width, renderer.height, fps, audio_path=audio_path,
+                          preset=preset, crf=crf, threads=threads) as out:
+            # Segments read so far that may still be on screen, in stream order
+            held = []
+            transcript = [] if sidecars else None
+            upcoming = next(segments, None)
+            last = None
+            total_frames = None
+            first_frame = 0
+            while total_frames is None or first_frame < total_frames:
+                end_frame = first_frame + window_frames
+                with span("stream_segments"):
+                    while upcoming is not None and upcoming['start'] < end_frame / fps:
+                        if last is not None and upcoming['start'] < last['start']:
+                            raise ValueError("Segments must come in start order")
+                        held.append(upcoming)
+                        if transcript is not None:
+                            transcript.append(upcoming)
+                        last = upcoming
+                        _check_cancel(cancel)
+                        upcoming = next(segments, None)
+                if upcoming is None and total_frames is None:
+                    total_frames = _total_frames([last] if last else [], fps)
+                    progress.total_frames = total_frames
+                if total_frames is not None:
+                    end_frame = min(end_frame, total_frames)
+
+                # Segments that ended before the window's first frame can't show again
+                start_time = first_frame / fps
+                held = [seg for seg in held if seg['start'] > start_time or seg['end'] >= start_time]
+                timing = TimingIndex(held, wipe=karaoke_wipe)
+                renderer.set_segments(held, timing)
+
+                with span("frame_loop"):
+                    runs = timing.state_runs(fps, end_frame, first_frame=first_frame)
+                    count("unique_states", len(runs))
+                    for state, run_start, n_frames in runs:
+                        _check_cancel(cancel)
+                        frame_bgr = renderer.render_state(state)
+                        for _ in range(n_frames):
+                            out.write(frame_bgr)
+                        event = progress.tick("frames", run_start + n_frames)
+                        if event:
+                            yield event
+                first_frame = end_frame
+
+            count("frames", total_frames)
+            print("\nFinishing encode...")
+            yield progress.event("finish", total_frames)
+
+        if transcript is not None:
+            style = {'font_path': font_path, 'color_active': color_active, 'color_inactive': color_inactive,
+                     'resolution': tuple(resolution), 'karaoke_wipe': karaoke_wipe}
+            paths = export_subtitles(transcript, output_path, **_ass_style(style))
+            print(f"Subtitles: {', '.join(paths.values())}")
+    except BaseException:
+        _remove_partial(output_path, stamp)
+        raise
+    finally:
+        # Stops a producer such as a running transcription
+        if hasattr(segments, 'close'):
+            segments.close()
+
+    print(f"Done! {output_path}")
+    yield progress.event("done", total_frames)
+
+@traced("create_stream_video")
+def create_stream_video(audio_path, segments, output_path="output.mp4",
+                        bg_image_path=None, font_path=None,
+                        color_active=(255, 230, 0, 255),
+                        color_inactive=(200, 200, 200, 180),
+                        preset="medium", crf=23, threads=0,
+                        resolution=(WIDTH, HEIGHT), fps=FPS, karaoke_wipe=False, sidecars=False,
+                        cancel=None, on_progress=None):
+    """
+    Blocking render_stream: prints progress or passes every event to
+    on_progress(event).
+    """
+    events = render_stream(audio_path, segments, output_path, bg_image_path, font_path,
+                           color_active, color_inactive, preset, crf, threads, resolution, fps,
+                           karaoke_wipe, sidecars, cancel)
+    try:
+        for event in events:
+            if on_progress is not None:
+                on_progress(event)
+            else:
+                _print_progress(event)
+    finally:
+        events.close()
@@ -0,0 +1,219 @@
+import os
+
+# Colors as in the renderer: (r, g, b[, a]) with a = 255 opaque
+SUNG_COLOR = (255, 255, 255, 255)
+SHADOW_COLOR = (0, 0, 0, 128)
+
+def _timed_words(segment):
+    """
+    (word, start, end) for every word the renderer draws in a segment.
+    Words without timing count as sung from the start, like in TimingIndex.
+    """
+    words = [w for w in segment['text'].strip().split(' ') if w]
+    timings = segment.get('words', [])
+    timed = []
+    for idx, word in enumerate(words):
+        if idx < len(timings):
+            timed.append((word, timings[idx]['start'], timings[idx]['end']))
+        else:
+            timed.append((word, segment['start'], segment['start']))
+    return timed
+
+def _visible_spans(segments):
+    """
+    (segment, start, end) in play order, matching what the renderer shows:
+    the later of two overlapping segments, and the outer one again once a
+    segment nested inside it has ended (see TimingIndex).
+    """
+    ordered = sorted(segments, key=lambda seg: seg['start'])
+    times = sorted({t for seg in ordered for t in (seg['start'], seg['end'])})
+    spans = []
+    # Segments that started and are still running, in start order
+    active = []
+    upcoming = 0
+    for lo, hi in zip(times, times[1:]):
+        while upcoming < len(ordered) and ordered[upcoming]['start'] <= lo:
+            active.append(ordered[upcoming])
+            upcoming += 1
+        active = [seg for seg in active if seg['end'] >= hi]
+        if not active or not active[-1]['text'].strip():
+            continue
+        seg = active[-1]
+        if spans and spans[-1][0] is seg and spans[-1][2] == lo:
+            spans[-1] = (seg, spans[-1][1], hi)
+        else:
+            spans.append((seg, lo, hi))
+    return spans
+
+def _ass_time(t):
+    cs = max(0, round(t * 100))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+def _srt_time(t):
+    ms = max(0, round(t * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def _lrc_time(t):
+    cs = max(0, round(t * 100))
+    return f"{cs // 6000:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+def ass_color(color):
+    """
+    RGBA tuple -> ASS style color &HAABBGGRR (ASS alpha 00 is opaque).
+    """
+    r, g, b = color[:3]
+    a = color[3] if len(color) > 3 else 255
+    return f"&H{255 - a:02X}{b:02X}{g:02X}{r:02X}"
+
+def _ass_override(color):
+    # Fill color and alpha override tags for one color
+    r, g, b = color[:3]
+    a = color[3] if len(color) > 3 else 255
+    return f"\\1c&H{b:02X}{g:02X}{r:02X}&\\1a&H{255 - a:02X}&"
+
+def _ass_escape(text):
+    # Braces start override blocks and a backslash starts a tag
+    return text.replace('\\', '/').replace('{', '(').replace('}', ')')
+
+def _karaoke_line(segment, line_start, color_active, karaoke_wipe, wrap=None):
+    """
+    Dialogue text for one segment. Each word is an ASS karaoke syllable:
+    \\k switches it from the inactive (secondary) to the active (primary)
+    color when it starts, \\kf sweeps it across instead, and a \\t turns it
+    white once it has been sung. Like in the renderer, only the word being
+    sung casts a shadow. Tag state carries over to the following words,
+    so every word restores the active color first.
+    """
+    k_tag = "\\kf" if karaoke_wipe else "\\k"
+    shadow_on = f"\\4a&H{255 - SHADOW_COLOR[3]:02X}&"
+    shadow_off = "\\4a&HFF&"
+
+    timed = _timed_words(segment)
+    breaks = set()
+    if wrap is not None:
+        word_idx = 0
+        for line in wrap(segment['text'].strip())[:-1]:
+            word_idx += len([w for w in line.split(' ') if w])
+            breaks.add(word_idx)
+
+    def cs(t):
+        return max(0, round((t - line_start) * 100))
+
+    def ms(t):
+        return max(0, round((t - line_start) * 1000))
+
+    parts = []
+    cursor = 0
+    for idx, (word, start, end) in enumerate(timed):
+        start, end = max(start, line_start), max(end, start, line_start)
+        if cs(start) > cursor:
+            # Silent syllable for the pause before the word
+            parts.append(f"{{\\k{cs(start) - cursor}}}")
+            cursor = cs(start)
+        duration = max(0, cs(end) - cursor)
+        cursor += duration
+        tags = (f"{k_tag}{duration}{_ass_override(color_active)}{shadow_off}"
+                f"\\t({ms(start)},{ms(start) + 1},{shadow_on})"
+                f"\\t({ms(end)},{ms(end) + 1},{shadow_off}{_ass_override(SUNG_COLOR)})")
+        separator = "" if idx == 0 else ("\\N" if idx in breaks else " ")
+        parts.append(f"{separator}{{{tags}}}{_ass_escape(word)}")
+    return "".join(parts)
+
+def write_ass(segments, path, font_name="Arial", font_size=60,
+              color_active=(255, 230, 0, 255), color_inactive=(200, 200, 200, 180),
+              resolution=(1920, 1080), karaoke_wipe=False, shadow_depth=2,
+              bold=False, italic=False, wrap=None):
+    """
+    Writes an Advanced SubStation Alpha file with \\k karaoke timing per word,
+    laid out like the frame renderer: one segment at a time, centered.
+    wrap(text) -> lines fixes the line breaks (e.g. PIL-measured, to match
+    the renderer); without it libass wraps at 80% of the width.
+    """
+    width, height = resolution
+    margin = width // 10
+    style = ",".join(str(v) for v in [
+        "Lyrics", font_name, font_size,
+        ass_color(color_active), ass_color(color_inactive),
+        "&H00000000", ass_color(SHADOW_COLOR),
+        -1 if bold else 0, -1 if italic else 0, 0, 0,
+        100, 100, 0, 0,
+        # BorderStyle 1, no outline, drop shadow; Alignment 5 = middle center
+        1, 0, shadow_depth, 5, margin, margin, 0, 1,
+    ])
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        # 2 = break only at \N, 0 = smart wrapping
+        f"WrapStyle: {2 if wrap is not None else 0}",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, "
+        "Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: {style}",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for seg, start, end in _visible_spans(segments):
+        # Karaoke offsets count from the event start as ASS stores it
+        line_start = round(start, 2)
+        text = _karaoke_line(seg, line_start, color_active, karaoke_wipe, wrap)
+        lines.append(f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Lyrics,,0,0,0,,{text}")
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def write_srt(segments, path):
+    """
+    Plain SRT, one cue per segment.
+    """
+    cues = []
+    for idx, (seg, start, end) in enumerate(_visible_spans(segments), 1):
+        cues.append(f"{idx}\n{_srt_time(start)} --> {_srt_time(end)}\n{seg['text'].strip()}\n")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(cues))
+    return path
+
+def write_lrc(segments, path, title=None):
+    """
+    Enhanced LRC: a [mm:ss.xx] line per segment and a <mm:ss.xx> stamp
+    before every word, which most karaoke players understand. Word stamps
+    are kept within their line's span (a segment shown again after a
+    nested one ends starts mid-line), like the ASS karaoke offsets.
+    """
+    lines = [f"[ti:{title}]"] if title else []
+    for seg, start, end in _visible_spans(segments):
+        words = " ".join(f"<{_lrc_time(min(max(w_start, start), end))}>{word}"
+                         for word, w_start, _ in _timed_words(seg))
+        lines.append(f"[{_lrc_time(start)}]{words} <{_lrc_time(end)}>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+SUBTITLE_FORMATS = ("srt", "ass", "lrc")
+
+def export_subtitles(segments, base_path, formats=SUBTITLE_FORMATS, title=None, **ass_style):
+    """
+    Writes <base_path>.<ext> for each format. ass_style goes to write_ass.
+    Returns {format: path}.
+    """
+    base = os.path.splitext(base_path)[0]
+    paths = {}
+    for fmt in formats:
+        path = f"{base}.{fmt}"
+        if fmt == "srt":
+            write_srt(segments, path)
+        elif fmt == "ass":
+            write_ass(segments, path, **ass_style)
+        elif fmt == "lrc":
+            write_lrc(segments, path, title=title)
+        else:
+            raise ValueError(f"Unknown subtitle format: {fmt}")
+        paths[fmt] = path
+    return paths
@@ -0,0 +1,145 @@
+import numpy as np
+
+# Word states used for the on-screen state of a segment
+WORD_INACTIVE = 0
+WORD_ACTIVE = 1
+WORD_SUNG = 2
+# Active word with a karaoke wipe: WORD_WIPE + level, where level
+# (0..WIPE_LEVELS) is how far the fill has moved across the word
+WORD_WIPE = 3
+WIPE_LEVELS = 64
+
+def segment_word_count(segment):
+    """
+    Number of words the renderer draws for a segment (empty tokens are skipped).
+    """
+    return len([w for w in segment['text'].strip().split(' ') if w])
+
+class TimingIndex:
+    """
+    Array-backed index over segment and word timings.
+    Built once per render; answers "what is on screen" for a whole batch of
+    frame times with vectorized lookups instead of per-frame Python scans.
+
+    Segments are expected in chronological order as Whisper returns them.
+    Where two segments overlap, the one that started later wins; when it
+    ends first (one segment inside another), the latest-starting segment
+    that is still running shows again.
+    With wipe=True active words report their fill progress (WORD_WIPE + level)
+    instead of a plain WORD_ACTIVE.
+    """
+
+    def __init__(self, segments, wipe=False):
+        self.n_segments = len(segments)
+        self.wipe = wipe
+
+        starts = np.array([seg['start'] for seg in segments], dtype=np.float64)
+        ends = np.array([seg['end'] for seg in segments], dtype=np.float64)
+
+        # Stable sort so equal start times keep their list order
+        self.order = np.argsort(starts, kind='stable')
+        self.sorted_starts = starts[self.order]
+        self.sorted_ends = ends[self.order]
+        # Latest end among the segments up to each sorted position
+        self.max_ends = np.maximum.accumulate(self.sorted_ends) if len(segments) else self.sorted_ends
+
+        # Flattened word timings; words without timing behave like (0, 0)
+        counts = [segment_word_count(seg) for seg in segments]
+        self.word_offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        self.word_offsets[1:] = np.cumsum(counts)
+
+        total_words = int(self.word_offsets[-1])
+        self.word_starts = np.zeros(total_words, dtype=np.float64)
+        self.word_ends = np.zeros(total_words, dtype=np.float64)
+        for seg_idx, seg in enumerate(segments):
+            words_info = seg.get('words', [])[:counts[seg_idx]]
+            offset = self.word_offsets[seg_idx]
+            for word_idx, w_obj in enumerate(words_info):
+                self.word_starts[offset + word_idx] = w_obj['start']
+                self.word_ends[offset + word_idx] = w_obj['end']
+
+    def segment_at(self, times):
+        """
+        Index of the visible segment for every time in `times` (-1 for none).
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if self.n_segments == 0:
+            return np.full(times.shape, -1, dtype=np.int64)
+
+        pos = np.searchsorted(self.sorted_starts, times, side='right') - 1
+        clipped = np.clip(pos, 0, None)
+        visible = (pos >= 0) & (times <= self.sorted_ends[clipped])
+        result = np.where(visible, self.order[clipped], -1)
+
+        # The latest segment to start has ended but an earlier one is still
+        # running: walk back to it (rare, only inside nested segments)
+        for i in np.flatnonzero((pos >= 0) & ~visible & (times <= self.max_ends[clipped])):
+            p = pos.flat[i] - 1
+            while self.sorted_ends[p] < times.flat[i]:
+                p -= 1
+            result.flat[i] = self.order[p]
+        return result
+
+    def word_states(self, seg_idx, times):
+        """
+        Matrix of word states with shape (len(times), n_words) for one segment.
+        """
+        times = np.asarray(times, dtype=np.float64)[:, None]
+        lo, hi = self.word_offsets[seg_idx], self.word_offsets[seg_idx + 1]
+        starts = self.word_starts[lo:hi][None, :]
+        ends = self.word_ends[lo:hi][None, :]
+
+        states = np.full((times.shape[0], hi - lo), WORD_INACTIVE, dtype=np.uint8)
+        active = (starts <= times) & (times <= ends)
+        if self.wipe:
+            progress = (times - starts) / np.maximum(ends - starts, 1e-9)
+            levels = np.clip(progress * WIPE_LEVELS, 0, WIPE_LEVELS).astype(np.uint8)
+            states[active] = (WORD_WIPE + levels)[active]
+        else:
+            states[active] = WORD_ACTIVE
+        states[times > ends] = WORD_SUNG
+        return states
+
+    def state_at(self, current_time):
+        """
+        Hashable key for everything visible at current_time, or None.
+        """
+        seg_idx = int(self.segment_at([current_time])[0])
+        if seg_idx < 0:
+            return None
+        states = self.word_states(seg_idx, [current_time])[0]
+        return (seg_idx, tuple(states.tolist()))
+
+    def state_runs(self, fps, total_frames, first_frame=0):
+        """
+        Groups consecutive frames that share the same on-screen state.
+        Returns a list of (state, first_frame, n_frames) runs covering
+        frames first_frame .. total_frames - 1.
+        """
+        frame_ids = np.arange(first_frame, total_frames)
+        if frame_ids.size == 0:
+            return []
+        times = frame_ids / fps
+        seg_ids = self.segment_at(times)
+
+        # Blocks of consecutive frames showing the same segment (or nothing)
+        block_starts = np.flatnonzero(np.diff(seg_ids)) + 1
+        block_starts = np.concatenate(([0], block_starts, [len(frame_ids)]))
+
+        runs = []
+        for b in range(len(block_starts) - 1):
+            lo, hi = block_starts[b], block_starts[b + 1]
+            seg_idx = int(seg_ids[lo])
+            if seg_idx < 0:
+                runs.append((None, int(frame_ids[lo]), int(hi - lo)))
+                continue
+
+            states = self.word_states(seg_idx, times[lo:hi])
+            # Rows where any word changes state start a new run
+            changes = np.flatnonzero(np.any(states[1:] != states[:-1], axis=1)) + 1
+            run_starts = np.concatenate(([0], changes, [hi - lo]))
+            for r in range(len(run_starts) - 1):
+                r_lo, r_hi = run_starts[r], run_starts[r + 1]
+                state = (seg_idx, tuple(states[r_lo].tolist()))
+                runs.append((state, int(frame_ids[lo + r_lo]), int(r_hi - r_lo)))
+        return runs
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+class Tracer:
+    """
+    Collects timed spans and counters for one job.
+    Spans nest and can come from several threads. The result can be
+    exported as a Chrome trace (chrome://tracing, Perfetto) or as a plain
+    JSON summary.
+    """
+
+    def __init__(self, name="job"):
+        self.name = name
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def _now_us(self):
+        return (time.perf_counter() - self._t0) * 1e6
+
+    @contextmanager
+    def span(self, name, **args):
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            event = {
+                'name': name, 'ph': 'X', 'ts': round(start, 1),
+                'dur': round(self._now_us() - start, 1),
+                'pid': os.getpid(), 'tid': threading.get_ident(),
+            }
+            if args:
+                event['args'] = args
+            with self._lock:
+                self.events.append(event)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        Total seconds per span name, plus the counters.
+        """
+        totals = {}
+        with self._lock:
+            for event in self.events:
+                totals[event['name']] = totals.get(event['name'], 0) + event['dur'] / 1e6
+            counters = dict(self.counters)
+        return {
+            'spans': {name: round(seconds, 4) for name, seconds in totals.items()},
+            'counters': counters,
+        }
+
+    def export_chrome(self, path):
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        # Counters show up as one sample at the end of the trace
+        end = self._now_us()
+        for name, value in counters.items():
+            events.append({'name': name, 'ph': 'C', 'ts': round(end, 1), 'pid': os.getpid(),
+                           'args': {name: value}})
+        with open(path, "w") as f:
+            json.dump({'traceEvents': events, 'otherData': {'job': self.name}}, f)
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump(dict(self.summary(), job=self.name), f, indent=2)
+
+class _NullTracer:
+    """
+    Used when nothing is being traced; every call is a no-op.
+    """
+
+    @contextmanager
+    def span(self, name, **args):
+        yield
+
+    def count(self, name, value=1):
+        pass
+
+NULL_TRACER = _NullTracer()
+_current = contextvars.ContextVar("genlyrics_tracer", default=NULL_TRACER)
+
+def get_tracer():
+    return _current.get()
+
+@contextmanager
+def use_tracer(tracer):
+    """
+    Makes tracer the target of span()/count() in this thread/context.
+    """
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+
+def span(name, **args):
+    return _current.get().span(name, **args)
+
+def count(name, value=1):
+    _current.get().count(name, value)
+
+def traced(name):
+    """
+    Decorator that wraps every call of a function in a span.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def profiled(path=None):
+    """
+    Runs the block under cProfile and dumps the stats to path (if given).
+    """
+    if not path:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time (Python 3.12+)
+        print(f"Profiler busy, not profiling {path}")
+        yield None
+        return
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,99 @@
+import subprocess
+import time
+import tempfile
+from tracing import span, count
+from audio_io import mux_audio_args
+
+class FFmpegWriter:
+    """
+    Streams raw frames into a single ffmpeg process.
+    The video is encoded and the audio muxed in the same pass, with no
+    intermediate file. Writes block while ffmpeg is busy (the pipe applies
+    backpressure), so frames never pile up in memory.
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_path=None,
+                 pix_fmt="bgr24", preset="medium", crf=23, threads=0,
+                 audio_codec="aac", audio_bitrate="192k"):
+        self.output_path = output_path
+        self.frame_size = width * height * 3
+        # Time spent blocked on the pipe, i.e. waiting for the encoder
+        self.write_seconds = 0.0
+        self.frames_written = 0
+
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', pix_fmt,
+            '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', '-',
+        ]
+        if audio_path:
+            cmd += ['-i', audio_path]
+        cmd += [
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p', '-threads', str(threads),
+        ]
+        if audio_path:
+            cmd += mux_audio_args(audio_path, audio_codec, audio_bitrate) + ['-shortest']
+        cmd.append(output_path)
+
+        # stderr goes to a temp file so a chatty ffmpeg can never fill a pipe and stall
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                      stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def write(self, frame):
+        """
+        Writes one HxWx3 uint8 frame. Blocks until ffmpeg accepts it.
+        """
+        data = memoryview(frame).cast('B')
+        if len(data) != self.frame_size:
+            raise ValueError(f"Frame has {len(data)} bytes, expected {self.frame_size}")
+        started = time.perf_counter()
+        try:
+            self._proc.stdin.write(data)
+            self.frames_written += 1
+        except BrokenPipeError:
+            self._proc.wait()
+            raise RuntimeError(f"ffmpeg exited early: {self._read_stderr()}")
+        finally:
+            self.write_seconds += time.perf_counter() - started
+
+    def close(self):
+        """
+        Finishes the encode and waits for ffmpeg to exit.
+        """
+        with span("ffmpeg_finish"):
+            if self._proc.stdin and not self._proc.stdin.closed:
+                try:
+                    self._proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = self._proc.wait()
+        count("frames_encoded", self.frames_written)
+        count("encode_write_wait_s", round(self.write_seconds, 4))
+        message = self._read_stderr()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({returncode}): {message}")
+
+    def abort(self):
+        """
+        Stops ffmpeg without finishing the file.
+        """
+        self._proc.kill()
+        self._proc.wait()
+        self._stderr.close()
+
+    def _read_stderr(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()